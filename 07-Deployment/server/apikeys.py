@@ -0,0 +1,58 @@
+# API keys let service clients (e.g. the box office) authenticate each request with
+#     Authorization: Bearer thk_<prefix>_<secret>
+# instead of logging in: no bcrypt check and no session. A key is random, so it doesn't need a
+# slow hash like a password does; the database keeps an HMAC-SHA256 of it, keyed with
+# API_KEY_SECRET (or SECRET_KEY), so a copy of the table can't be used to forge or check keys.
+# Checking a key is one lookup by its unique prefix and a constant-time compare of the digests.
+# Rotating the secret revokes every key.
+import hashlib
+import hmac
+import secrets
+
+from config import db
+from flask import current_app
+from models import ApiKey
+
+API_KEY_SCHEME = "thk"
+PREFIX_BYTES = 6
+SECRET_BYTES = 32
+
+
+def api_key_digest(key):
+    secret = current_app.config["API_KEY_SECRET"] or current_app.config["SECRET_KEY"]
+    if not secret:
+        raise ValueError("API keys need API_KEY_SECRET or SECRET_KEY to be set")
+    if isinstance(secret, str):
+        secret = secret.encode("utf-8")
+    return hmac.new(secret, key.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def parse_api_key(key):
+    """The prefix of a well formed key, otherwise None."""
+    scheme, _, rest = key.partition("_")
+    prefix, _, secret = rest.partition("_")
+    if scheme != API_KEY_SCHEME or len(prefix) != 2 * PREFIX_BYTES or not secret:
+        return None
+    return prefix
+
+
+def create_api_key(user_id, name):
+    """Adds a key for the user to the session; returns it with the key, which isn't stored."""
+    prefix = secrets.token_hex(PREFIX_BYTES)
+    key = f"{API_KEY_SCHEME}_{prefix}_{secrets.token_urlsafe(SECRET_BYTES)}"
+    api_key = ApiKey(user_id=user_id, name=name, prefix=prefix, digest=api_key_digest(key))
+    db.session.add(api_key)
+    return api_key, key
+
+
+def authenticate_api_key(key):
+    """The (id, user_id) of the key, or None if it is unknown or revoked."""
+    prefix = parse_api_key(key)
+    if prefix is None:
+        return None
+    row = db.session.execute(
+        db.select(ApiKey.id, ApiKey.user_id, ApiKey.digest).where(ApiKey.prefix == prefix)
+    ).first()
+    if row is None or not hmac.compare_digest(row.digest, api_key_digest(key)):
+        return None
+    return row.id, row.user_id
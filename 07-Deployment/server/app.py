@@ -2,7 +2,7 @@
 # 📚 Review With Students:
 # Set up:
 # cd into server and run the following in Terminal:
-# export FLASK_APP=app.py
+# export FLASK_APP=app.py (flask finds the create_app factory)
 # export FLASK_RUN_PORT=5000
 # flask db init
 # flask db revision --autogenerate -m'Create tables'
@@ -12,13 +12,70 @@
 # In Terminal, run:
 # `honcho start -f Procfile.dev`
 
-from config import api, app
-from flask import Flask, abort, jsonify, make_response, request, session
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import click
+from apikeys import authenticate_api_key, create_api_key
+from auth import ADMIN, PUBLIC, access, compile_access_rules
+from batch import run_batch
+from cast_counts import repair_cast_counts
+from config import api, bcrypt, config_from_env, db
+from events import create_broker, event_stream, queue_change
+from exports import csv_lines, ndjson_lines
+from flask import (
+    Flask,
+    Response,
+    abort,
+    current_app,
+    g,
+    jsonify,
+    make_response,
+    request,
+    send_file,
+    session,
+    stream_with_context,
+)
 
 # from flask_cors import CORS
 from flask_restful import Resource
-from models import CastMember, Production, User, db
-from werkzeug.exceptions import NotFound, Unauthorized
+from health import HealthCheckMiddleware
+from httpcache import (
+    LocalCachingProxy,
+    SurrogateKeyPurger,
+    add_surrogate_keys,
+    row_key,
+    set_cache_headers,
+)
+from images import IMAGE_HASH, ImageStore, PosterError, ThumbnailsUnavailable, ingest_posters
+from models import (
+    ApiKey,
+    CastMember,
+    Production,
+    ServerSession,
+    Tombstone,
+    User,
+    row_to_dict,
+    serialized_columns,
+)
+from querycache import FromCache, QueryCache, cascading_tables
+from readmodels import CAST_MEMBER_READ, PRODUCTION_READ, production_summaries
+from schemas import (
+    API_KEY_SCHEMA,
+    CAST_MEMBER_SCHEMA,
+    PRODUCTION_SCHEMA,
+    SIGNUP_SCHEMA,
+    Field,
+    Schema,
+    to_int,
+)
+from sessions import ServerSideSessionInterface, create_session_store, purge_sessions
+from singleflight import SingleFlightCache
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from stats import StatsRefresher, production_stats_dict, refresh_stats
+from werkzeug.exceptions import Forbidden, NotFound, Unauthorized
 
 # 2.✅ Navigate to "models.py"
 # Continue on Step 3
@@ -26,37 +83,77 @@ from werkzeug.exceptions import NotFound, Unauthorized
 # CORS(app)
 
 
-# the following adds route-specific authorization
-@app.before_request
+# the following adds route-specific authorization (registered in create_app)
+# the access level of each endpoint and method comes from the @access decorators on the Resources
 def check_if_logged_in():
-    open_access_list = ["signup", "login", "logout", "authorized", "productions"]
+    level = current_app.extensions["access_rules"].get((request.endpoint, request.method))
+    if level == PUBLIC:
+        return
+
+    # service clients send an API key instead of the session cookie; their requests don't open a
+    # session (see apikeys.py)
+    authorization = request.authorization
+    if authorization is not None:
+        api_key = None
+        if authorization.type == "bearer" and authorization.token:
+            api_key = authenticate_api_key(authorization.token)
+        if api_key is None:
+            raise Unauthorized
+        api_key_id, user_id = api_key
+    else:
+        api_key_id, user_id = None, session.get("user_id")
+        if not user_id:
+            raise Unauthorized
+    # (set on every request: the sub-requests of a batch share g)
+    g.api_key_id, g.user_id = api_key_id, user_id
+    if level == ADMIN:
+        user = db.session.get(User, user_id, options=[FromCache("user")])
+        if not user or not user.admin:
+            raise Forbidden
+
+
+# productions are serialized without their cast unless the request asks for ?include=cast_members
+def include_cast_members():
+    return "cast_members" in request.args.get("include", "").split(",")
+
+
+def serialize_production(production, with_cast=False):
+    if with_cast:
+        return production.to_dict(rules=("-cast_members.production",))
+    return production.to_dict(rules=("-cast_members",))
 
-    # if the user is in session OR the request endpoint is open-access, the request will be processed as usual
-    if request.endpoint not in open_access_list and not session.get("user_id"):
-        raise Unauthorized
+
+# list items carry the size of their cast from the cast_count column, without loading the cast;
+# they are read as plain rows, not ORM instances (see readmodels.py)
+def productions_body(with_cast):
+    return make_response(production_summaries(with_cast), 200).get_data()
 
 
 class Productions(Resource):
+    # the serialized list is cached, and concurrent requests that miss the cache share one
+    # computation (see singleflight.py)
+    @access(PUBLIC)
     def get(self):
-        production_list = [p.to_dict() for p in Production.query.all()]
-        response = make_response(
-            production_list,
-            200,
+        with_cast = include_cast_members()
+        body = current_app.extensions["single_flight"].get(
+            f"productions?with_cast={with_cast}", lambda: productions_body(with_cast)
         )
+        response = current_app.response_class(body, 200, mimetype="application/json")
+        # cast counts change with the cast
+        add_surrogate_keys(response, "productions", "cast_members")
 
         return response
 
+    # the INSERT returns the server-generated columns (eager defaults), and the new production is
+    # serialized before the commit expires it, so the write is a single statement
     def post(self):
-        form_json = request.get_json()
-        try:
-            new_production = Production(**form_json)
-        except ValueError as e:
-            abort(422, e.args[0])
+        new_production = Production(**PRODUCTION_SCHEMA.load(request.get_json()))
 
         db.session.add(new_production)
-        db.session.commit()
+        db.session.flush()
 
-        response_dict = new_production.to_dict()
+        response_dict = serialize_production(new_production)
+        db.session.commit()
 
         response = make_response(
             response_dict,
@@ -64,77 +161,468 @@ class Productions(Resource):
         )
         return response
 
+    # bulk endpoints: the body names the productions either by "ids" or by a "filter"
+    # and each call runs as a single set-based statement instead of one commit per row
+    @access(ADMIN)
+    def patch(self):
+        req_json = bulk_body()
+        changes = BULK_UPDATE_SCHEMA.load(req_json.get("changes", {}))
+        if not changes:
+            abort(422, f"Bulk updates may only change: {', '.join(sorted(BULK_UPDATABLE_FIELDS))}")
+
+        stmt = (
+            update(Production)
+            .where(bulk_selection(req_json))
+            .values(**changes, version=Production.version + 1)
+            .returning(Production.id)
+        )
+        try:
+            updated_ids = db.session.execute(stmt).scalars().all()
+            queue_change(db.session, "updated", "productions", updated_ids)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            abort(422, "Invalid production data")
+
+        return make_response({"updated": len(updated_ids), "ids": updated_ids}, 200)
+
+    @access(ADMIN)
+    def delete(self):
+        # cast members go with their production through ON DELETE CASCADE
+        production_ids = db.session.execute(
+            delete(Production)
+            .where(bulk_selection(bulk_body()))
+            .returning(Production.id)
+        ).scalars().all()
+        Tombstone.record("productions", production_ids)
+        queue_change(db.session, "deleted", "productions", production_ids)
+        db.session.commit()
+
+        return make_response({"deleted": len(production_ids), "ids": production_ids}, 200)
+
+
+BULK_UPDATABLE_FIELDS = {"ongoing", "genre", "director", "description", "budget"}
+BULK_UPDATE_SCHEMA = PRODUCTION_SCHEMA.only(BULK_UPDATABLE_FIELDS, partial=True)
+BULK_FILTER_FIELDS = {"ongoing", "genre", "director"}
+BULK_FILTER_SCHEMA = PRODUCTION_SCHEMA.only(BULK_FILTER_FIELDS, partial=True)
+
+
+def bulk_body():
+    req_json = request.get_json()
+    if not isinstance(req_json, dict):
+        abort(422, "The body must be a JSON object")
+    return req_json
+
+
+def bulk_selection(req_json):
+    ids = req_json.get("ids")
+    filters = req_json.get("filter")
+    if ids:
+        if not isinstance(ids, list) or not all(
+            isinstance(id, int) and not isinstance(id, bool) for id in ids
+        ):
+            abort(422, "ids must be a list of integers")
+        return Production.id.in_(ids)
+    if filters and isinstance(filters, dict) and set(filters) <= BULK_FILTER_FIELDS:
+        filters = BULK_FILTER_SCHEMA.load(filters)
+        return db.and_(*[getattr(Production, k) == v for k, v in filters.items()])
+    abort(422, f"Provide a list of ids or a filter on: {', '.join(sorted(BULK_FILTER_FIELDS))}")
+
 
 api.add_resource(Productions, "/productions")
 
 
+# rows written this long before the cursor are sent again, to catch transactions that
+# committed after the client's last sync but were stamped with an earlier time
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+# GET /productions/changes?since=<cursor> returns what changed after the cursor; without a cursor
+# it returns everything. Deleting a production also deletes its cast members (ON DELETE CASCADE)
+# without a tombstone of their own, so clients drop the cast of every deleted production.
+@access(PUBLIC)
+class ProductionChanges(Resource):
+    def get(self):
+        since = request.args.get("since")
+        productions = PRODUCTION_READ.select()
+        cast_members = CAST_MEMBER_READ.select()
+        tombstones = []
+        if since:
+            try:
+                after = datetime.fromisoformat(since) - SYNC_OVERLAP
+            except ValueError:
+                abort(422, "since must be a cursor returned by a previous sync")
+            productions = productions.where(Production.updated_at > after)
+            cast_members = cast_members.where(CastMember.updated_at > after)
+            tombstones = Tombstone.query.filter(Tombstone.deleted_at > after).all()
+
+        productions = PRODUCTION_READ.all(productions)
+        cast_members = CAST_MEMBER_READ.all(cast_members)
+        timestamps = [r.updated_at for r in productions + cast_members]
+        timestamps += [t.deleted_at for t in tombstones]
+        cursor = max(timestamps).isoformat() if timestamps else since
+
+        response = make_response(
+            {
+                "productions": [PRODUCTION_READ.to_dict(p) for p in productions],
+                "cast_members": [CAST_MEMBER_READ.to_dict(c) for c in cast_members],
+                "deleted": {
+                    table_name: [t.row_id for t in tombstones if t.table_name == table_name]
+                    for table_name in ("productions", "cast_members")
+                },
+                "cursor": cursor,
+            },
+            200,
+        )
+        return add_surrogate_keys(response, "productions", "cast_members")
+
+
+api.add_resource(ProductionChanges, "/productions/changes")
+
+
+# Server-Sent Events: one "change" event per committed write to productions or cast members
+@access(PUBLIC)
+class ProductionStream(Resource):
+    def get(self):
+        return Response(
+            event_stream(
+                current_app.extensions["change_feed"],
+                heartbeat=current_app.config["CHANGE_FEED_HEARTBEAT"],
+            ),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
+api.add_resource(ProductionStream, "/productions/stream")
+
+
+# aggregates for dashboards, read from production_stats (see stats.py), so they can lag the
+# latest writes by a few seconds
+class ProductionStats(Resource):
+    def get(self):
+        return make_response(production_stats_dict(), 200)
+
+
+api.add_resource(ProductionStats, "/productions/stats")
+
+
+# cast changes don't bump the production's version, so the representation with the cast is
+# validated by the version plus a digest of its cast members' ids and versions
+def production_etag(production, production_dict, with_cast):
+    if not with_cast:
+        return str(production.version)
+    cast = ",".join(
+        f"{id}:{version}"
+        for id, version in sorted((c["id"], c["version"]) for c in production_dict["cast_members"])
+    )
+    return f"{production.version}-cast-{hashlib.sha256(cast.encode()).hexdigest()[:16]}"
+
+
 class ProductionByID(Resource):
     def get(self, id):
-        production = Production.query.filter_by(id=id).first()
+        production = Production.query.options(FromCache("production")).filter_by(id=id).first()
         if not production:
             raise NotFound
-        production_dict = production.to_dict()
+        with_cast = include_cast_members()
+        production_dict = serialize_production(production, with_cast)
         response = make_response(production_dict, 200)
+        response.set_etag(production_etag(production, production_dict, with_cast))
+        add_surrogate_keys(
+            response, row_key("productions", id), *(["cast_members"] if with_cast else [])
+        )
 
-        return response
+        return response.make_conditional(request)
 
+    # the update is a single UPDATE ... WHERE id=? AND version=? RETURNING statement,
+    # the expected version comes from the If-Match header (412) or a "version" field (409)
     def patch(self, id):
+        changes = PRODUCTION_PATCH_SCHEMA.load(request.form)
+        expected_version = changes.pop("version", None)
+        if not changes:
+            abort(422, "Invalid production data")
+
+        return versioned_update(Production, id, changes, expected_version)
+
+    def delete(self, id):
         production = Production.query.filter_by(id=id).first()
         if not production:
             raise NotFound
+        db.session.delete(production)
+        Tombstone.record("productions", [id])
+        db.session.commit()
+
+        response = make_response("", 204)
+
+        return response
+
+
+# any of the fields, plus the version the client last saw
+PRODUCTION_PATCH_SCHEMA = Schema(partial=True, version=Field(to_int), **PRODUCTION_SCHEMA.fields)
+CAST_MEMBER_PATCH_SCHEMA = Schema(partial=True, version=Field(to_int), **CAST_MEMBER_SCHEMA.fields)
+VERSION_SCHEMA = Schema(version=Field(to_int))
 
-        for attr in request.form:
-            setattr(production, attr, request.form[attr])
 
-        production.ongoing = bool(request.form["ongoing"])
-        production.budget = int(request.form["budget"])
+def etag_versions(etags):
+    return [int(tag) for tag in etags.as_set() if tag.isdigit()]
 
-        db.session.add(production)
+
+# runs a single UPDATE ... WHERE id=? AND version=? RETURNING statement for a versioned model;
+# before_commit runs only if a row was updated
+def versioned_update(model, id, changes, expected_version=None, before_commit=None):
+    stmt = update(model).where(model.id == id)
+    if request.if_match and not request.if_match.star_tag:
+        stmt = stmt.where(model.version.in_(etag_versions(request.if_match)))
+    elif expected_version is not None:
+        stmt = stmt.where(model.version == expected_version)
+
+    stmt = stmt.values(**changes, version=model.version + 1).returning(
+        *serialized_columns(model)
+    )
+    try:
+        row = db.session.execute(stmt).mappings().first()
+        if row:
+            queue_change(db.session, "updated", model.__tablename__, [id])
+            if before_commit is not None:
+                before_commit()
         db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(422, "Invalid data")
 
-        production_dict = production.to_dict()
+    if not row:
+        if not db.session.get(model, id):
+            raise NotFound
+        if request.if_match:
+            abort(412, "The resource has been modified since it was fetched")
+        abort(409, "The resource has been modified since it was fetched")
 
-        response = make_response(production_dict, 200)
-        return response
+    response = make_response(row_to_dict(row), 200)
+    response.set_etag(str(row["version"]))
+    return response
+
+
+api.add_resource(ProductionByID, "/productions/<int:id>")
+
+
+CAST_MEMBERS_PAGE_SIZE = 50
+CAST_MEMBERS_MAX_PAGE_SIZE = 200
+
+
+# cast members are paginated by keyset: ?after=<last id seen>&limit=<page size>
+class ProductionCastMembers(Resource):
+    def get(self, id):
+        if not db.session.get(Production, id, options=[FromCache("production")]):
+            raise NotFound
+
+        after = request.args.get("after", 0, type=int)
+        limit = request.args.get("limit", CAST_MEMBERS_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, CAST_MEMBERS_MAX_PAGE_SIZE))
+        cast_members = (
+            CastMember.query.options(FromCache("cast_member_page"))
+            .filter(CastMember.production_id == id, CastMember.id > after)
+            .order_by(CastMember.id)
+            .limit(limit + 1)
+            .all()
+        )
+        page = cast_members[:limit]
+
+        response = make_response(
+            {
+                "cast_members": [c.to_dict(rules=("-production",)) for c in page],
+                "next_cursor": page[-1].id if len(cast_members) > limit else None,
+            },
+            200,
+        )
+        return add_surrogate_keys(response, row_key("productions", id), "cast_members")
+
+    # a missing production fails the INSERT's foreign key, so it isn't looked up first
+    def post(self, id):
+        new_cast_member = CastMember(
+            **CAST_MEMBER_SCHEMA.load(request.get_json()), production_id=id
+        )
+        db.session.add(new_cast_member)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            raise NotFound
+
+        response_dict = new_cast_member.to_dict(rules=("-production",))
+        db.session.commit()
+
+        return make_response(response_dict, 201)
+
+
+api.add_resource(ProductionCastMembers, "/productions/<int:id>/cast_members")
+
+
+class CastMemberByID(Resource):
+    def get(self, id):
+        cast_member = db.session.get(CastMember, id, options=[FromCache("cast_member")])
+        if not cast_member:
+            raise NotFound
+        response = make_response(cast_member.to_dict(rules=("-production",)), 200)
+        response.set_etag(str(cast_member.version))
+        add_surrogate_keys(response, row_key("cast_members", id))
+
+        return response.make_conditional(request)
+
+    def patch(self, id):
+        changes = CAST_MEMBER_PATCH_SCHEMA.load(request.get_json())
+        expected_version = changes.pop("version", None)
+        if not changes:
+            abort(422, "Invalid cast member data")
+
+        return versioned_update(CastMember, id, changes, expected_version)
 
     def delete(self, id):
-        production = Production.query.filter_by(id=id).first()
-        if not production:
+        cast_member = db.session.get(CastMember, id)
+        if not cast_member:
             raise NotFound
-        db.session.delete(production)
+        db.session.delete(cast_member)
+        Tombstone.record("cast_members", [id])
         db.session.commit()
 
-        response = make_response("", 204)
+        return make_response("", 204)
+
+
+api.add_resource(CastMemberByID, "/cast_members/<int:id>")
+
+
+# the poster is the request body, or the "poster" file of a multipart form
+class ProductionPoster(Resource):
+    def put(self, id):
+        if request.content_length and request.content_length > current_app.config["POSTER_MAX_BYTES"]:
+            abort(413, "The poster is too large")
+        poster = request.files.get("poster")
+        data = poster.read() if poster else request.get_data()
+        if not data:
+            abort(422, "Send the poster image as the body or as a \"poster\" file")
+        expected_version = VERSION_SCHEMA.load(request.form).get("version")
+
+        images = current_app.extensions["images"]
+        try:
+            thumbnails, urls = images.prepare(data)
+        except ThumbnailsUnavailable as e:
+            abort(501, str(e))
+        except PosterError as e:
+            abort(422, str(e))
+
+        # the files are written once the UPDATE has matched, so a missing production or a
+        # version conflict leaves nothing on disk
+        return versioned_update(
+            Production,
+            id,
+            {"thumbnails": urls},
+            expected_version,
+            before_commit=lambda: images.store(thumbnails),
+        )
+
+
+api.add_resource(ProductionPoster, "/productions/<int:id>/poster")
 
+
+# a thumbnail's URL is the hash of its bytes, so it can be cached forever
+@access(PUBLIC)
+class ImageByHash(Resource):
+    def get(self, image_hash):
+        if not IMAGE_HASH.match(image_hash):
+            raise NotFound
+        path = current_app.extensions["images"].path(image_hash)
+        if not os.path.exists(path):
+            raise NotFound
+
+        response = send_file(path, mimetype="image/jpeg", etag=image_hash, max_age=IMAGE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
         return response
 
 
-api.add_resource(ProductionByID, "/productions/<int:id>")
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+api.add_resource(ImageByHash, "/images/<string(length=64):image_hash>")
+
+
+EXPORT_FORMATS = {
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+    "csv": (csv_lines, "text/csv"),
+}
+
+
+# the full catalog, streamed while it is read from the database
+class ProductionsExport(Resource):
+    def get(self, export_format):
+        lines, mimetype = EXPORT_FORMATS[export_format]
+        return Response(
+            stream_with_context(lines()),
+            mimetype=mimetype,
+            headers={
+                "Content-Disposition": f'attachment; filename="productions.{export_format}"'
+            },
+        )
+
+
+api.add_resource(ProductionsExport, "/exports/productions.<any(ndjson, csv):export_format>")
+
+
+# several API calls in one request, e.g. the client's initial load (see batch.py); each
+# sub-request is authorized on its own
+@access(PUBLIC)
+class Batch(Resource):
+    def post(self):
+        req_json = request.get_json(silent=True)
+        items = req_json.get("requests") if isinstance(req_json, dict) else None
+        if not isinstance(items, list):
+            abort(422, 'Send {"requests": [{"method": ..., "path": ...}, ...]}')
+        max_requests = current_app.config["BATCH_MAX_REQUESTS"]
+        if len(items) > max_requests:
+            abort(413, f"A batch may hold at most {max_requests} requests")
+
+        responses = run_batch(current_app._get_current_object(), session._get_current_object(), items)
+        return make_response({"responses": responses}, 200)
+
+
+api.add_resource(Batch, "/batch")
+
+
+# hit statistics of the answering worker's query cache
+@access(ADMIN)
+class QueryCacheStats(Resource):
+    def get(self):
+        return make_response(
+            {"pid": os.getpid(), **current_app.extensions["query_cache"].report()}, 200
+        )
+
+
+api.add_resource(QueryCacheStats, "/query_cache")
 
 
 # 10.✅ Create a Signup route
+@access(PUBLIC)
 class Signup(Resource):
     # 10.2 The signup route should have a post method
     def post(self):
         # 10.2.1 Get the values from the request body with get_json
-        req_json = request.get_json()
-        try:
-            # 10.2.2 Create a new user, however only pass in the name, email and admin values
-            # 10.2.3 Call the password_hash method on the new user and set it to the password from the request
-            new_user = User(
-                name=req_json["name"],
-                email=req_json["email"],
-                password_hash=req_json["password"],
-            )
-        except:
-            abort(422, "Invalid user data")
-        # 10.2.4 Add and commit
+        # (the body is validated first: a 422 lists every missing or invalid field)
+        req_json = SIGNUP_SCHEMA.load(request.get_json())
+        # 10.2.2 Create a new user, however only pass in the name, email and admin values
+        # 10.2.3 Call the password_hash method on the new user and set it to the password from the request
+        new_user = User(
+            name=req_json["name"],
+            email=req_json["email"],
+            password_hash=req_json["password"],
+        )
+        # 10.2.4 Add and flush (the INSERT assigns the id)
         db.session.add(new_user)
-        db.session.commit()
+        db.session.flush()
         # 10.2.5 Add the user id to session under the key of user_id
         session["user_id"] = new_user.id
+        # (serialized before the commit, which expires the user and would make to_dict() reload it)
+        response = make_response(new_user.to_dict(), 201)
+        db.session.commit()
         # 10.2.6 send the new user back to the client with a status of 201
-        return make_response(new_user.to_dict(), 201)
+        return response
 
 
 # 10.3 Test out your route with the client or Postman
@@ -147,6 +635,7 @@ api.add_resource(Signup, "/signup")
 
 
 # 11.✅ Create a Login route
+@access(PUBLIC)
 class Login(Resource):
     # 11.2 Create a post method
     def post(self):
@@ -174,10 +663,11 @@ api.add_resource(Login, "/login")
 # 13.2.1 Check to see if the user_id is in session
 # 13.2.2 If found query the user and send it to the client
 # 13.2.3 If not found return a 401 Unauthorized error
+@access(PUBLIC)
 class AuthorizedSession(Resource):
     def get(self):
         try:
-            user = User.query.filter_by(id=session["user_id"]).first()
+            user = User.query.options(FromCache("user")).filter_by(id=session["user_id"]).first()
             response = make_response(user.to_dict(), 200)
             return response
         except:
@@ -194,9 +684,11 @@ api.add_resource(AuthorizedSession, "/authorized")
 # 14.2.1 Set the user_id in sessions to None
 # 14.2.1 Create a response with no content and a 204
 # 14.3 Test out your route with the client or Postman
+@access(PUBLIC)
 class Logout(Resource):
     def delete(self):
-        session["user_id"] = None
+        # clearing the session deletes it from the session store, so the old cookie is revoked
+        session.clear()
         response = make_response("", 204)
         return response
 
@@ -206,7 +698,49 @@ api.add_resource(Logout, "/logout")
 # 14.✅ Navigate to client navigation
 
 
-@app.errorhandler(NotFound)
+# the logged in user's API keys (see apikeys.py). A key can't manage keys, so a leaked key can't
+# mint new ones or revoke the others
+def forbid_api_keys():
+    if g.api_key_id is not None:
+        abort(make_response({"message": "Forbidden: API keys are managed from a session."}, 403))
+
+
+class ApiKeys(Resource):
+    def get(self):
+        forbid_api_keys()
+        api_keys = ApiKey.query.filter_by(user_id=g.user_id).order_by(ApiKey.id).all()
+        return make_response([api_key.to_dict() for api_key in api_keys], 200)
+
+    def post(self):
+        forbid_api_keys()
+        req_json = API_KEY_SCHEMA.load(request.get_json(silent=True))
+        api_key, key = create_api_key(g.user_id, req_json["name"])
+        db.session.flush()
+        # the only time the key is shown
+        response = make_response({**api_key.to_dict(), "key": key}, 201)
+        db.session.commit()
+        return response
+
+
+api.add_resource(ApiKeys, "/api_keys")
+
+
+class ApiKeyByID(Resource):
+    # revoking deletes the key
+    def delete(self, id):
+        forbid_api_keys()
+        result = db.session.execute(
+            delete(ApiKey).where(ApiKey.id == id, ApiKey.user_id == g.user_id)
+        )
+        if not result.rowcount:
+            raise NotFound
+        db.session.commit()
+        return make_response("", 204)
+
+
+api.add_resource(ApiKeyByID, "/api_keys/<int:id>")
+
+
 def handle_not_found(e):
     response = make_response(
         {"message": "Not Found: Sorry the resource you are looking for does not exist"},
@@ -216,15 +750,108 @@ def handle_not_found(e):
     return response
 
 
-@app.errorhandler(Unauthorized)
 def handle_unauthorized(e):
     return make_response(
         {"message": "Unauthorized: you must be logged in to make that request."}, 401
     )
 
 
+def handle_forbidden(e):
+    return make_response(
+        {"message": "Forbidden: you must be an admin to make that request."}, 403
+    )
+
+
+def create_app(config=None):
+    """Builds the app; without a config the settings come from the environment and .env."""
+    if config is None:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        config = config_from_env()
+
+    app = Flask(__name__)
+    app.config.update(config)
+    app.json.compact = False
+
+    db.init_app(app)
+    bcrypt.init_app(app)
+    api.init_app(app)
+
+    # Flask-Migrate imports alembic, the slowest import in the app, and only the
+    # `flask db` commands need it, so the web server never loads it
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        from importer import import_productions
+
+        Migrate(app, db)
+        app.cli.add_command(import_productions)
+        app.cli.add_command(ingest_posters)
+        app.cli.add_command(refresh_stats)
+        app.cli.add_command(repair_cast_counts)
+        app.cli.add_command(purge_sessions)
+
+    app.session_interface = ServerSideSessionInterface(
+        create_session_store(app, db, ServerSession.__table__),
+        cache_size=app.config["SESSION_CACHE_SIZE"],
+        cache_ttl=app.config["SESSION_CACHE_TTL"],
+        touch_interval=app.config["SESSION_TOUCH_INTERVAL"],
+    )
+
+    app.extensions["change_feed"] = create_broker(app)
+    app.extensions["query_cache"] = QueryCache(
+        size=app.config["QUERY_CACHE_SIZE"],
+        ttl=app.config["QUERY_CACHE_TTL"],
+        max_rows=app.config["QUERY_CACHE_MAX_ROWS"],
+        cascades=cascading_tables(db.metadata),
+    )
+    app.extensions["query_cache"].listen_to(app.extensions["change_feed"])
+    app.extensions["images"] = ImageStore(
+        app.config["IMAGE_DIR"] or os.path.join(app.instance_path, "images")
+    )
+
+    app.extensions["single_flight"] = SingleFlightCache(
+        ttl=app.config["SINGLE_FLIGHT_TTL"],
+        stale=app.config["SINGLE_FLIGHT_STALE"],
+        lock_dir=app.config["SINGLE_FLIGHT_LOCK_DIR"],
+    )
+    app.extensions["single_flight"].listen_to(app.extensions["change_feed"])
+
+    # this worker's writes invalidate right away, before the change feed brings them back
+    app.extensions["change_hooks"] = [
+        app.extensions["single_flight"].invalidate,
+        StatsRefresher(app, interval=app.config["STATS_REFRESH_INTERVAL"]),
+    ]
+    if app.config["HTTP_CACHE_PURGE_URL"]:
+        app.extensions["change_hooks"].append(
+            SurrogateKeyPurger(
+                app.config["HTTP_CACHE_PURGE_URL"], app.config["HTTP_CACHE_PURGE_TOKEN"]
+            )
+        )
+
+    app.before_request(check_if_logged_in)
+    app.after_request(set_cache_headers)
+    if app.config["HTTP_CACHE_LOCAL_PROXY"]:
+        app.wsgi_app = LocalCachingProxy(app.wsgi_app)
+        app.wsgi_app.listen_to(app.extensions["change_feed"])
+    app.wsgi_app = HealthCheckMiddleware(
+        app,
+        app.wsgi_app,
+        timeout_ms=app.config["READYZ_TIMEOUT_MS"],
+        migration_check_ttl=app.config["READYZ_MIGRATION_CHECK_TTL"],
+    )
+    app.register_error_handler(NotFound, handle_not_found)
+    app.register_error_handler(Unauthorized, handle_unauthorized)
+    app.register_error_handler(Forbidden, handle_forbidden)
+
+    # compiled last, once every route is registered
+    app.extensions["access_rules"] = compile_access_rules(app)
+
+    return app
+
+
 if __name__ == "__main__":
-    app.run(port=5555, debug=True)
+    create_app().run(port=5555, debug=True)
     import ipdb
 
     ipdb.set_trace()
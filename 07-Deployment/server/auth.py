@@ -0,0 +1,39 @@
+# Route authorization is declared next to the routes with @access and compiled once, when the
+# app is created, into a read-only {(endpoint, method): level} mapping that before_request reads.
+from types import MappingProxyType
+
+PUBLIC = "public"
+AUTHENTICATED = "authenticated"
+ADMIN = "admin"
+
+
+def access(level):
+    """Marks a Resource class (all of its methods) or a single Resource method with an access level.
+
+    A level on a method wins over the level on its class; anything unmarked needs a logged in user.
+    """
+
+    def decorator(target):
+        target.access_level = level
+        return target
+
+    return decorator
+
+
+def compile_access_rules(app):
+    rules = {}
+    for endpoint, view in app.view_functions.items():
+        view_class = getattr(view, "view_class", None)
+        class_level = getattr(view_class or view, "access_level", None)
+        if endpoint == "static":
+            class_level = PUBLIC
+        for rule in app.url_map.iter_rules(endpoint):
+            for method in rule.methods:
+                handler = getattr(view_class, method.lower(), None)
+                if method == "HEAD":
+                    handler = getattr(view_class, "get", None)
+                level = getattr(handler, "access_level", None) or class_level or AUTHENTICATED
+                if method == "OPTIONS":
+                    level = PUBLIC
+                rules[(endpoint, method)] = level
+    return MappingProxyType(rules)
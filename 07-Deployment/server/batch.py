@@ -0,0 +1,94 @@
+# POST /batch runs a list of sub-requests against the app's own routes in one HTTP request:
+#     {"requests": [{"method": "GET", "path": "/authorized"},
+#                   {"method": "GET", "path": "/productions/1", "headers": {"If-None-Match": "\"3\""}},
+#                   {"method": "PATCH", "path": "/productions/1", "form": {"title": "Cats"}},
+#                   {"method": "POST", "path": "/productions/1/cast_members", "body": {"name": "Jo"}}]}
+# Each sub-request gets a request context of its own, so views read their own args and body, but
+# they all share the batch's session (loaded once), its Authorization header, and its app context,
+# and so one database session.
+# Access rules apply to every sub-request; after_request hooks and the session save run once, for
+# the batch. Results come back in order: {"responses": [{"status": 200, "body": ...}, ...]}.
+import logging
+
+from config import db
+from flask import request
+from flask.ctx import RequestContext
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+
+logger = logging.getLogger(__name__)
+
+BATCH_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE"}
+# headers of a sub-response that are passed back to the client
+FORWARDED_HEADERS = ("ETag", "Location")
+
+
+def item_error(status, message):
+    return {"status": status, "body": {"message": message}}
+
+
+def run_batch(app, session, items):
+    base_url = request.host_url
+    # a client authenticated by API key sends its key once, for the whole batch
+    headers = {}
+    if "Authorization" in request.headers:
+        headers["Authorization"] = request.headers["Authorization"]
+    return [run_item(app, session, item, base_url, headers) for item in items]
+
+
+def run_item(app, session, item, base_url, headers):
+    if (
+        not isinstance(item, dict)
+        or not isinstance(item.get("method"), str)
+        or not isinstance(item.get("path"), str)
+        or not item["path"].startswith("/")
+    ):
+        return item_error(422, "Each request needs a method and a path starting with /")
+    method = item["method"].upper()
+    if method not in BATCH_METHODS:
+        return item_error(422, f"Batched requests may use: {', '.join(sorted(BATCH_METHODS))}")
+
+    try:
+        environ = EnvironBuilder(
+            path=item["path"],
+            base_url=base_url,
+            method=method,
+            headers={**headers, **(item.get("headers") or {})},
+            json=item.get("body"),
+            data=item.get("form"),
+        ).get_environ()
+    except (TypeError, ValueError):
+        return item_error(422, "Send either a JSON body or a form, with string headers")
+
+    with RequestContext(app, environ, session=session):
+        if request.endpoint == "batch":
+            return item_error(422, "Batches can't be nested")
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = app.dispatch_request()
+            response = app.make_response(rv)
+        except HTTPException as e:
+            rv = app.handle_user_exception(e)
+            # an HTTPException without an error handler renders itself
+            response = app.make_response(rv.get_response() if isinstance(rv, HTTPException) else rv)
+        except Exception:
+            logger.exception("batched %s %s failed", method, item["path"])
+            db.session.rollback()
+            return item_error(500, "Internal Server Error")
+
+        if response.is_streamed:
+            response.close()
+            return item_error(422, "Streamed responses can't be batched")
+        if method == "HEAD" or response.status_code in (204, 304):
+            body = None
+        elif response.is_json:
+            body = response.get_json(silent=True)
+        else:
+            body = response.get_data(as_text=True) or None
+
+    result = {"status": response.status_code, "body": body}
+    headers = {name: response.headers[name] for name in FORWARDED_HEADERS if name in response.headers}
+    if headers:
+        result["headers"] = headers
+    return result
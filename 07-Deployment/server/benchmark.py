@@ -0,0 +1,552 @@
+#!/usr/bin/env python3
+# Performance benchmarks for the theater API.
+# They run against a scratch database (in-memory SQLite unless BENCHMARK_DATABASE_URI is set),
+# never against DATABASE_URI, because every benchmark drops and recreates the tables.
+# Usage: python benchmark.py [benchmark_name ...]
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+import urllib.request
+from time import perf_counter, sleep
+
+os.environ["DATABASE_URI"] = os.environ.get("BENCHMARK_DATABASE_URI", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+# the stats benchmark refreshes the view itself; a background refresh woken by an earlier
+# benchmark's writes would otherwise land in a later benchmark's statement counts
+os.environ.setdefault("STATS_REFRESH_INTERVAL", "3600")
+
+from app import create_app, productions_body
+from exports import csv_lines, ndjson_lines
+from models import CastMember, Production, User, db
+from readmodels import PRODUCTION_READ
+from sqlalchemy import create_engine, event, insert
+from stats import production_stats_dict, refresh_production_stats
+
+app = create_app()
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+def reset_database():
+    db.drop_all()
+    db.create_all()
+
+
+def seed_productions(count, cast_size, chunk_size=10000):
+    # inserted in chunks so that seeding large catalogs doesn't need them in memory all at once
+    for chunk_start in range(0, count, chunk_size):
+        db.session.execute(
+            insert(Production),
+            [
+                {
+                    "title": f"Production {i}",
+                    "genre": ["Drama", "Musical", "Opera"][i % 3],
+                    "budget": 1000.0 + i,
+                    "image": f"https://example.com/{i}.jpg",
+                    "director": f"Director {i % 50}",
+                    "description": "A benchmark production",
+                    "ongoing": bool(i % 2),
+                }
+                for i in range(chunk_start, min(chunk_start + chunk_size, count))
+            ],
+        )
+    production_ids = db.session.scalars(db.select(Production.id)).all()
+    per_chunk = max(1, chunk_size // max(cast_size, 1))
+    for chunk_start in range(0, len(production_ids) if cast_size else 0, per_chunk):
+        db.session.execute(
+            insert(CastMember),
+            [
+                {"name": f"Actor {i}", "role": f"Role {i}", "production_id": production_id}
+                for production_id in production_ids[chunk_start : chunk_start + per_chunk]
+                for i in range(cast_size)
+            ],
+        )
+    db.session.commit()
+    return production_ids
+
+
+def report(name, seconds, statements=None, **extra):
+    line = f"{name:<40} {seconds * 1000:>10.1f} ms"
+    if statements is not None:
+        line += f" {statements:>7} statements"
+    for key, value in extra.items():
+        line += f"  {key}={value}"
+    print(line)
+
+
+@benchmark
+def cascade_delete(cast_size=5000):
+    with app.app_context():
+        # what ProductionByID.delete did with an ORM-only cascade: load every cast member and delete it
+        reset_database()
+        (production_id,) = seed_productions(1, cast_size)
+        with StatementCounter(db.engine) as counter:
+            start = perf_counter()
+            production = db.session.get(Production, production_id)
+            for cast_member in production.cast_members:
+                db.session.delete(cast_member)
+            db.session.delete(production)
+            db.session.commit()
+            report(f"orm cascade ({cast_size} cast)", perf_counter() - start, counter.count)
+
+        # ON DELETE CASCADE with passive_deletes: a single DELETE for the production
+        reset_database()
+        (production_id,) = seed_productions(1, cast_size)
+        with StatementCounter(db.engine) as counter:
+            start = perf_counter()
+            db.session.delete(db.session.get(Production, production_id))
+            db.session.commit()
+            report(f"database cascade ({cast_size} cast)", perf_counter() - start, counter.count)
+        assert CastMember.query.count() == 0
+
+
+@benchmark
+def conditional_gets(requests=200):
+    # revalidating a production with If-None-Match (304s) against fetching it again; then the
+    # ETag of the production with its cast must change with the cast. Fails if it doesn't.
+    with app.app_context():
+        reset_database()
+        (production_id,) = seed_productions(1, 5)
+        db.session.add(User(name="admin", email="admin@example.com", password_hash="admin", admin=True))
+        db.session.commit()
+    client = app.test_client()
+    client.post("/login", json={"name": "admin", "password": "admin"})
+
+    for label, path in (
+        ("production", f"/productions/{production_id}"),
+        ("with cast", f"/productions/{production_id}?include=cast_members"),
+    ):
+        etag = client.get(path).headers["ETag"]
+        for name, headers in (("200", {}), ("304", {"If-None-Match": etag})):
+            start = perf_counter()
+            for _ in range(requests):
+                client.get(path, headers=headers)
+            report(f"{requests} x GET {label}, {name}", perf_counter() - start)
+
+    path = f"/productions/{production_id}?include=cast_members"
+    etag = client.get(path).headers["ETag"]
+    assert client.get(f"/productions/{production_id}").headers["ETag"] != etag
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+    client.post(f"/productions/{production_id}/cast_members", json={"name": "New", "role": "Lead"})
+    response = client.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 200, "stale cast revalidated"
+    assert len(response.get_json()["cast_members"]) == 6
+
+
+@benchmark
+def query_cache(requests=200):
+    # a cached cast member against an uncached one; then the cast member must be gone from the
+    # cache once the database has cascaded a production delete to it. Fails if it isn't.
+    with app.app_context():
+        reset_database()
+        (production_id,) = seed_productions(1, 5)
+        cast_member_id = db.session.scalar(db.select(CastMember.id))
+        db.session.add(User(name="admin", email="admin@example.com", password_hash="admin", admin=True))
+        db.session.commit()
+        engine = db.engine
+    client = app.test_client()
+    client.post("/login", json={"name": "admin", "password": "admin"})
+    cache = app.extensions["query_cache"]
+    path = f"/cast_members/{cast_member_id}"
+
+    cache_size = cache.size
+    for name, size in (("uncached", 0), ("cached", cache_size)):
+        cache.clear()
+        cache.size = size
+        with StatementCounter(engine) as counter:
+            start = perf_counter()
+            for _ in range(requests):
+                assert client.get(path).status_code == 200
+            report(f"{requests} x GET {name}", perf_counter() - start, counter.count)
+    cache.size = cache_size
+
+    assert client.delete(f"/productions/{production_id}").status_code == 204
+    assert client.get(path).status_code == 404, "cascaded delete served from the cache"
+
+    # other workers invalidate what the change feed carries, which is only the production
+    with app.app_context():
+        (production_id,) = seed_productions(1, 5)
+        cast_member_id = db.session.scalar(db.select(CastMember.id))
+    path = f"/cast_members/{cast_member_id}"
+    assert client.get(path).status_code == 200
+    cache.invalidate(["productions"])
+    assert not cache.report()["entries"], "cast members kept after a production invalidation"
+
+
+def read_smaps_rollup(pid):
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields
+
+
+def child_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+@benchmark
+def gunicorn_memory(workers=4, requests=200, port=5599):
+    # Linux only: compares per-worker memory with and without preload_app, after some traffic
+    with tempfile.TemporaryDirectory() as tmp:
+        database_uri = f"sqlite:///{tmp}/benchmark.db"
+        db.metadata.create_all(create_engine(database_uri))
+        for preload in ("0", "1"):
+            env = dict(
+                os.environ,
+                DATABASE_URI=database_uri,
+                GUNICORN_PRELOAD=preload,
+                WEB_CONCURRENCY=str(workers),
+                PORT=str(port),
+            )
+            server = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                for _ in range(100):
+                    try:
+                        urllib.request.urlopen(f"http://127.0.0.1:{port}/productions")
+                        break
+                    except OSError:
+                        sleep(0.1)
+                for _ in range(requests):
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/productions").read()
+                sleep(0.5)
+                usage = [read_smaps_rollup(pid) for pid in child_pids(server.pid)]
+            finally:
+                server.terminate()
+                server.wait()
+
+            uss = sum(u["Private_Clean"] + u["Private_Dirty"] for u in usage) / len(usage)
+            pss = sum(u["Pss"] for u in usage) / len(usage)
+            print(
+                f"{'preload' if preload == '1' else 'no preload':<40} "
+                f"{len(usage)} workers  {uss / 1024:>6.1f} MiB unique  {pss / 1024:>6.1f} MiB proportional per worker"
+            )
+
+
+@benchmark
+def startup(top=10):
+    # cold start of a fresh interpreter building the app, with the -X importtime breakdown
+    server_dir = os.path.dirname(os.path.abspath(__file__))
+    start = perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "from app import create_app; create_app()"],
+        cwd=server_dir,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    report("startup (import + create_app)", perf_counter() - start)
+
+    # each line is "import time: self [us] | cumulative | <indented module name>";
+    # summing the self times per top-level package shows where the startup goes
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    print(f"{'total import time':<40} {sum(packages.values()) / 1000:>10.1f} ms")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {package:<38} {self_us / 1000:>10.1f} ms")
+
+
+@benchmark
+def export(productions=200_000, cast_size=5):
+    # 200k productions with 5 cast members each: 1M joined rows
+    productions = int(os.environ.get("BENCHMARK_EXPORT_PRODUCTIONS", productions))
+    with app.app_context():
+        reset_database()
+        seed_productions(productions, cast_size)
+        rows = productions * cast_size
+        for name, lines in (("ndjson", ndjson_lines), ("csv", csv_lines)):
+            start = perf_counter()
+            size = sum(len(chunk) for chunk in lines())
+            seconds = perf_counter() - start
+            db.session.rollback()
+            # tracemalloc slows Python down a lot, so memory is measured on a second run
+            tracemalloc.start()
+            for chunk in lines():
+                pass
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report(
+                f"export {name} ({rows} rows)",
+                seconds,
+                rows_per_s=f"{rows / seconds:,.0f}",
+                MiB=f"{size / 2**20:.0f}",
+                peak_MiB=f"{peak / 2**20:.1f}",
+            )
+            db.session.rollback()
+
+
+@benchmark
+def coalescing(productions=2000, cast_size=5, concurrency=16):
+    # a burst of identical /productions?include=cast_members requests right after a write
+    with app.app_context():
+        reset_database()
+        seed_productions(productions, cast_size)
+        engine = db.engine
+    single_flight = app.extensions["single_flight"]
+
+    def burst(get):
+        barrier = threading.Barrier(concurrency)
+
+        def request():
+            barrier.wait()
+            get()
+
+        threads = [threading.Thread(target=request) for _ in range(concurrency)]
+        with StatementCounter(engine) as counter:
+            start = perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return perf_counter() - start, counter.count
+
+    def uncoalesced():
+        with app.test_request_context("/productions?include=cast_members"):
+            productions_body(True)
+
+    client = app.test_client()
+    for name, get in (
+        ("uncoalesced", uncoalesced),
+        ("coalesced", lambda: client.get("/productions?include=cast_members")),
+    ):
+        single_flight.invalidate()
+        seconds, statements = burst(get)
+        report(f"{concurrency} concurrent misses, {name}", seconds, statements)
+
+
+@benchmark
+def cast_counts(productions=2000, cast_size=20):
+    # the list used to need every cast member loaded to tell how many there are
+    with app.app_context():
+        reset_database()
+        seed_productions(productions, cast_size)
+        for name, with_cast in (("loaded cast", True), ("cast_count", False)):
+            with StatementCounter(db.engine) as counter:
+                with app.test_request_context():
+                    start = perf_counter()
+                    productions_body(with_cast)
+                    seconds = perf_counter() - start
+            report(f"list, cast sizes from {name}", seconds, counter.count)
+            db.session.close()
+
+
+@benchmark
+def read_models(productions=100_000):
+    # memory held per production by ORM instances (state, identity map, instrumented attributes)
+    # and by the named tuples of readmodels.py, then the time to serialize them all
+    with app.app_context():
+        reset_database()
+        seed_productions(productions, 0)
+        for name, load, serialize in (
+            ("orm", lambda: Production.query.all(), lambda p: p.to_dict(rules=("-cast_members",))),
+            (
+                "read model",
+                lambda: PRODUCTION_READ.all(PRODUCTION_READ.select()),
+                PRODUCTION_READ.to_dict,
+            ),
+        ):
+            start = perf_counter()
+            rows = load()
+            load_seconds = perf_counter() - start
+            start = perf_counter()
+            for row in rows:
+                serialize(row)
+            serialize_seconds = perf_counter() - start
+            del rows
+            db.session.close()
+            # measured on a second load, tracemalloc slows Python down a lot
+            tracemalloc.start()
+            rows = load()
+            held, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report(
+                f"load {productions} productions, {name}",
+                load_seconds,
+                bytes_per_row=f"{held / len(rows):,.0f}",
+                MiB=f"{held / 2**20:.1f}",
+            )
+            report(f"serialize {productions} productions, {name}", serialize_seconds)
+            del rows
+            db.session.close()
+
+
+@benchmark
+def write_round_trips():
+    # statements per write: the server-generated columns come back from RETURNING and responses are
+    # serialized before the commit, so nothing is read back afterwards. Fails if that regresses.
+    # with Postgres, writes to the catalog also NOTIFY the change feed, in their transaction
+    notify = 1 if app.extensions["change_feed"].notifies_in_transaction else 0
+    expected = {
+        "POST /productions": 1 + notify,
+        "PATCH /productions/<id>": 1 + notify,
+        "POST /productions/<id>/cast_members": 1 + notify,
+        "PATCH /cast_members/<id>": 1 + notify,
+        # the user, and the new session
+        "POST /signup": 2,
+    }
+    with app.app_context():
+        reset_database()
+        (production_id,) = seed_productions(1, 1)
+        cast_member_id = db.session.scalar(db.select(CastMember.id))
+        db.session.add(User(name="admin", email="admin@example.com", password_hash="admin", admin=True))
+        db.session.commit()
+        engine = db.engine
+    # restarts the session touch interval, so that a flush of last_seen (and purge of expired
+    # sessions) left over from the earlier benchmarks doesn't land in the counts
+    app.session_interface.reset()
+    client = app.test_client()
+    client.post("/login", json={"name": "admin", "password": "admin"})
+
+    writes = {
+        "POST /productions": lambda: client.post(
+            "/productions", json={"title": "New", "genre": "Drama", "budget": 500}
+        ),
+        "PATCH /productions/<id>": lambda: client.patch(
+            f"/productions/{production_id}", data={"title": "Renamed"}
+        ),
+        "POST /productions/<id>/cast_members": lambda: client.post(
+            f"/productions/{production_id}/cast_members", json={"name": "New", "role": "Lead"}
+        ),
+        "PATCH /cast_members/<id>": lambda: client.patch(
+            f"/cast_members/{cast_member_id}", json={"name": "Renamed"}
+        ),
+        "POST /signup": lambda: app.test_client().post(
+            "/signup", json={"name": "new", "email": "new@example.com", "password": "new"}
+        ),
+    }
+    for name, write in writes.items():
+        with StatementCounter(engine) as counter:
+            start = perf_counter()
+            response = write()
+            seconds = perf_counter() - start
+        assert response.status_code in (200, 201), (name, response.status_code)
+        report(name, seconds, counter.count)
+        assert counter.count == expected[name], f"{name}: {counter.count} statements"
+
+
+@benchmark
+def batch(details=20):
+    # the client's initial load: /authorized, /productions, then one detail fetch per production
+    with app.app_context():
+        reset_database()
+        production_ids = seed_productions(details, 5)
+        db.session.add(User(name="user", email="user@example.com", password_hash="user"))
+        db.session.commit()
+        engine = db.engine
+    client = app.test_client()
+    client.post("/login", json={"name": "user", "password": "user"})
+    paths = ["/authorized", "/productions", *[f"/productions/{id}" for id in production_ids]]
+
+    app.extensions["query_cache"].clear()
+    app.extensions["single_flight"].invalidate()
+    with StatementCounter(engine) as counter:
+        start = perf_counter()
+        for path in paths:
+            assert client.get(path).status_code == 200
+        report(f"{len(paths)} requests", perf_counter() - start, counter.count)
+
+    app.extensions["query_cache"].clear()
+    app.extensions["single_flight"].invalidate()
+    with StatementCounter(engine) as counter:
+        start = perf_counter()
+        response = client.post(
+            "/batch", json={"requests": [{"method": "GET", "path": path} for path in paths]}
+        )
+        report(f"1 batch of {len(paths)}", perf_counter() - start, counter.count)
+    assert all(item["status"] == 200 for item in response.get_json()["responses"])
+
+
+@benchmark
+def api_keys(requests=200):
+    # a service client logging in (bcrypt, then a session) vs. sending an API key with each request
+    with app.app_context():
+        reset_database()
+        (production_id,) = seed_productions(1, 5)
+        db.session.add(User(name="service", email="service@example.com", password_hash="service"))
+        db.session.commit()
+        engine = db.engine
+    path = f"/productions/{production_id}/cast_members"
+
+    client = app.test_client()
+    with StatementCounter(engine) as counter:
+        start = perf_counter()
+        assert client.post("/login", json={"name": "service", "password": "service"}).status_code == 200
+        report("POST /login", perf_counter() - start, counter.count)
+    key = client.post("/api_keys", json={"name": "benchmark"}).get_json()["key"]
+    client.delete("/logout")
+
+    for name, login, headers in (
+        ("with login", True, {}),
+        ("with API key", False, {"Authorization": f"Bearer {key}"}),
+    ):
+        client = app.test_client()
+        with StatementCounter(engine) as counter:
+            start = perf_counter()
+            if login:
+                client.post("/login", json={"name": "service", "password": "service"})
+            for _ in range(requests):
+                assert client.get(path, headers=headers).status_code == 200
+            report(f"{requests} x GET {name}", perf_counter() - start, counter.count)
+
+
+@benchmark
+def stats(sizes=(1000, 100000), cast_size=2):
+    # /productions/stats reads the precomputed production_stats rows; the refresh after writes
+    # grows with the catalog, the read doesn't
+    with app.app_context():
+        for count in sizes:
+            reset_database()
+            seed_productions(count, cast_size)
+            start = perf_counter()
+            refresh_production_stats(db.session.connection())
+            db.session.commit()
+            report(f"refresh stats ({count} productions)", perf_counter() - start)
+            with StatementCounter(db.engine) as counter:
+                start = perf_counter()
+                production_stats_dict()
+                report(f"read stats ({count} productions)", perf_counter() - start, counter.count)
+            # the next reset_database() can't drop the view under an open transaction
+            db.session.close()
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
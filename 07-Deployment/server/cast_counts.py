@@ -0,0 +1,124 @@
+# productions.cast_count is kept up to date by the database, in the transaction that writes the cast,
+# so every writer is covered: the API, the Core upserts of `flask import-productions`, psql.
+#   - Postgres: statement-level triggers that add up the transition tables, so a bulk insert of
+#     thousands of cast members costs one UPDATE per production instead of one per row
+#   - SQLite: row-level triggers
+# `flask repair-cast-counts` recounts them all, e.g. after the triggers were disabled for a load.
+import click
+from config import db
+from events import queue_change
+from flask.cli import with_appcontext
+from models import CastMember, Production
+from sqlalchemy import event
+
+POSTGRES_TRIGGERS = (
+    """
+    CREATE FUNCTION count_cast_members() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE productions SET cast_count = cast_count + added.n
+            FROM (SELECT production_id, COUNT(*) AS n FROM new_rows GROUP BY production_id) added
+            WHERE productions.id = added.production_id;
+        ELSIF TG_OP = 'DELETE' THEN
+            UPDATE productions SET cast_count = cast_count - removed.n
+            FROM (SELECT production_id, COUNT(*) AS n FROM old_rows GROUP BY production_id) removed
+            WHERE productions.id = removed.production_id;
+        ELSE
+            -- only cast members moved to another production change the counts
+            UPDATE productions SET cast_count = cast_count + moved.n
+            FROM (
+                SELECT production_id, SUM(delta) AS n FROM (
+                    SELECT o.production_id, -1 AS delta
+                    FROM old_rows o JOIN new_rows n ON n.id = o.id
+                    WHERE o.production_id IS DISTINCT FROM n.production_id
+                    UNION ALL
+                    SELECT n.production_id, 1
+                    FROM old_rows o JOIN new_rows n ON n.id = o.id
+                    WHERE o.production_id IS DISTINCT FROM n.production_id
+                ) deltas
+                GROUP BY production_id
+            ) moved
+            WHERE productions.id = moved.production_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER cast_members_count_insert AFTER INSERT ON cast_members
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_cast_members()
+    """,
+    """
+    CREATE TRIGGER cast_members_count_delete AFTER DELETE ON cast_members
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_cast_members()
+    """,
+    """
+    CREATE TRIGGER cast_members_count_update AFTER UPDATE ON cast_members
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_cast_members()
+    """,
+)
+
+SQLITE_TRIGGERS = (
+    """
+    CREATE TRIGGER cast_members_count_insert AFTER INSERT ON cast_members BEGIN
+        UPDATE productions SET cast_count = cast_count + 1 WHERE id = NEW.production_id;
+    END
+    """,
+    """
+    CREATE TRIGGER cast_members_count_delete AFTER DELETE ON cast_members BEGIN
+        UPDATE productions SET cast_count = cast_count - 1 WHERE id = OLD.production_id;
+    END
+    """,
+    """
+    CREATE TRIGGER cast_members_count_update AFTER UPDATE OF production_id ON cast_members
+    WHEN OLD.production_id IS NOT NEW.production_id BEGIN
+        UPDATE productions SET cast_count = cast_count - 1 WHERE id = OLD.production_id;
+        UPDATE productions SET cast_count = cast_count + 1 WHERE id = NEW.production_id;
+    END
+    """,
+)
+
+
+def create_cast_count_triggers(connection):
+    triggers = POSTGRES_TRIGGERS if connection.dialect.name == "postgresql" else SQLITE_TRIGGERS
+    for statement in triggers:
+        connection.exec_driver_sql(statement)
+
+
+# db.create_all() (tests, benchmarks) installs them with the table; dropping the table drops them
+@event.listens_for(CastMember.__table__, "after_create")
+def create_cast_count_triggers_after_table(table, connection, **kw):
+    create_cast_count_triggers(connection)
+
+
+@event.listens_for(db.metadata, "after_drop")
+def drop_cast_count_function(metadata, connection, **kw):
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql("DROP FUNCTION IF EXISTS count_cast_members()")
+
+
+def counted_cast_members():
+    return (
+        db.select(db.func.count(CastMember.id))
+        .where(CastMember.production_id == Production.id)
+        .scalar_subquery()
+    )
+
+
+@click.command("repair-cast-counts")
+@with_appcontext
+def repair_cast_counts():
+    """Recounts the cast of every production whose cast_count is off."""
+    counted = counted_cast_members()
+    repaired = db.session.execute(
+        db.update(Production)
+        .where(Production.cast_count != counted)
+        .values(cast_count=counted)
+        .returning(Production.id)
+    ).scalars().all()
+    queue_change(db.session, "updated", "productions", repaired)
+    db.session.commit()
+    click.echo(f"Repaired the cast count of {len(repaired)} productions")
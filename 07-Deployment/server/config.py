@@ -1,31 +1,86 @@
 # 1.✅ Import Bcrypt form flask_bcrypt
 # 1.1 Invoke Bcrypt and pass it app
+# The extensions are created here without an app; create_app (in app.py) binds them with init_app
 import os
 
-from dotenv import load_dotenv
-from flask import Flask
 from flask_bcrypt import Bcrypt
-from flask_migrate import Migrate
 from flask_restful import Api
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
-load_dotenv()
+db = SQLAlchemy()
 
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URI")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.json.compact = False
+bcrypt = Bcrypt()
 
-# generate a secrete key `python -c 'import os; print(os.urandom(16))'`
-app.secret_key = os.environ.get("SECRET_KEY")
+# below, we monkey-patch flask-restful's Api class to overwrite it's error_router with Flask's native error handler so that we can use the custom errorhandler we've registered on app
+Api.error_router = lambda self, handler, e: handler(e)
+api = Api()
 
-db = SQLAlchemy()
-migrate = Migrate(app, db)
 
-bcrypt = Bcrypt(app)
+# reads the settings from the environment; call load_dotenv() first to pick up a .env file
+def config_from_env():
+    return {
+        "SQLALCHEMY_DATABASE_URI": os.environ.get("DATABASE_URI"),
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        # generate a secrete key `python -c 'import os; print(os.urandom(16))'`
+        "SECRET_KEY": os.environ.get("SECRET_KEY"),
+        # the HMAC key of the API key digests (see apikeys.py); SECRET_KEY when it isn't set
+        "API_KEY_SECRET": os.environ.get("API_KEY_SECRET"),
+        # sessions are stored server side: "sqlalchemy" (sessions table), "filesystem" or "redis"
+        # (SESSION_REDIS_URL, or an in-process stand-in when it isn't set)
+        "SESSION_BACKEND": os.environ.get("SESSION_BACKEND", "sqlalchemy"),
+        "SESSION_FILE_DIR": os.environ.get("SESSION_FILE_DIR"),
+        "SESSION_REDIS_URL": os.environ.get("SESSION_REDIS_URL"),
+        "SESSION_CACHE_SIZE": int(os.environ.get("SESSION_CACHE_SIZE", 1024)),
+        "SESSION_CACHE_TTL": float(os.environ.get("SESSION_CACHE_TTL", 5)),
+        "SESSION_TOUCH_INTERVAL": float(os.environ.get("SESSION_TOUCH_INTERVAL", 60)),
+        # /readyz: connect and statement timeout of the database ping, and how long a migration
+        # check is reused
+        "READYZ_TIMEOUT_MS": int(os.environ.get("READYZ_TIMEOUT_MS", 1000)),
+        "READYZ_MIGRATION_CHECK_TTL": float(os.environ.get("READYZ_MIGRATION_CHECK_TTL", 5)),
+        # /productions/stream fan-out between workers: "postgres" (LISTEN/NOTIFY), "file"
+        # (CHANGE_FEED_FILE), "local" (this process only) or "auto" to pick from the database
+        "CHANGE_FEED_BACKEND": os.environ.get("CHANGE_FEED_BACKEND", "auto"),
+        "CHANGE_FEED_FILE": os.environ.get("CHANGE_FEED_FILE"),
+        "CHANGE_FEED_CLIENT_BUFFER": int(os.environ.get("CHANGE_FEED_CLIENT_BUFFER", 100)),
+        "CHANGE_FEED_HEARTBEAT": float(os.environ.get("CHANGE_FEED_HEARTBEAT", 15)),
+        # per-worker cache of FromCache query results; a size of 0 turns it off
+        "QUERY_CACHE_SIZE": int(os.environ.get("QUERY_CACHE_SIZE", 1000)),
+        "QUERY_CACHE_TTL": float(os.environ.get("QUERY_CACHE_TTL", 60)),
+        "QUERY_CACHE_MAX_ROWS": int(os.environ.get("QUERY_CACHE_MAX_ROWS", 1000)),
+        # poster thumbnails (defaults to instance/images) and the largest poster upload accepted
+        "IMAGE_DIR": os.environ.get("IMAGE_DIR"),
+        "POSTER_MAX_BYTES": int(os.environ.get("POSTER_MAX_BYTES", 10 * 1024 * 1024)),
+        # Cache-Control of public GETs: browsers can't be purged, so their max-age is short,
+        # while shared caches (s-maxage) are purged by Surrogate-Key after writes, through a CDN
+        # endpoint that takes POST with a Surrogate-Key header. HTTP_CACHE_LOCAL_PROXY puts
+        # LocalCachingProxy (httpcache.py) in front of the app instead
+        "HTTP_CACHE_MAX_AGE": int(os.environ.get("HTTP_CACHE_MAX_AGE", 5)),
+        "HTTP_CACHE_S_MAXAGE": int(os.environ.get("HTTP_CACHE_S_MAXAGE", 300)),
+        "HTTP_CACHE_STALE_WHILE_REVALIDATE": int(
+            os.environ.get("HTTP_CACHE_STALE_WHILE_REVALIDATE", 60)
+        ),
+        "HTTP_CACHE_PURGE_URL": os.environ.get("HTTP_CACHE_PURGE_URL"),
+        "HTTP_CACHE_PURGE_TOKEN": os.environ.get("HTTP_CACHE_PURGE_TOKEN"),
+        "HTTP_CACHE_LOCAL_PROXY": os.environ.get("HTTP_CACHE_LOCAL_PROXY") == "1",
+        # cached /productions bodies: fresh for SINGLE_FLIGHT_TTL seconds, then served stale for up
+        # to SINGLE_FLIGHT_STALE more while one request refreshes them; with SINGLE_FLIGHT_LOCK_DIR
+        # the workers also share the computation through lock files there
+        "SINGLE_FLIGHT_TTL": float(os.environ.get("SINGLE_FLIGHT_TTL", 30)),
+        "SINGLE_FLIGHT_STALE": float(os.environ.get("SINGLE_FLIGHT_STALE", 30)),
+        "SINGLE_FLIGHT_LOCK_DIR": os.environ.get("SINGLE_FLIGHT_LOCK_DIR"),
+        # the most sub-requests one POST /batch may carry
+        "BATCH_MAX_REQUESTS": int(os.environ.get("BATCH_MAX_REQUESTS", 25)),
+        # /productions/stats is recomputed this long after the first write of a burst
+        "STATS_REFRESH_INTERVAL": float(os.environ.get("STATS_REFRESH_INTERVAL", 5)),
+    }
 
-db.init_app(app)
 
-# below, we monkey-patch flask-restful's Api class to overwrite it's error_router with Flask's native error handler so that we can use the custom errorhandler we've registered on app
-Api.error_router = lambda self, handler, e: handler(e)
-api = Api(app)
+# SQLite only enforces foreign keys (and ON DELETE CASCADE) when asked to on each connection
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if type(dbapi_connection).__module__ == "sqlite3":
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
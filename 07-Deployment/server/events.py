@@ -0,0 +1,295 @@
+# Change feed behind GET /productions/stream.
+# Writes queue their changes on the SQLAlchemy session; an after_commit hook hands them to a broker,
+# which fans them out to the subscribers of every worker:
+#   - PostgresBroker: NOTIFY from inside the committing transaction (a before_commit hook), so
+#     publishing costs no connection of its own; one LISTEN thread per worker
+#   - FileBroker: appends to a shared file, one thread per worker tails it (for SQLite setups)
+#   - LocalBroker: this process only (tests, `flask run`)
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "production_changes"
+# Postgres caps a NOTIFY payload at 8000 bytes, so large bulk changes are split up
+MAX_IDS_PER_EVENT = 500
+# tables whose ORM inserts, updates and deletes are published automatically
+TRACKED_TABLES = ("productions", "cast_members")
+
+
+def queue_change(session, action, table, ids):
+    """Queues a change made with a Core statement; it is published if the transaction commits."""
+    if ids:
+        session.info.setdefault("pending_changes", []).append((action, table, list(ids)))
+
+
+@event.listens_for(Session, "after_flush")
+def collect_orm_changes(session, flush_context):
+    for action, objects in (
+        ("created", session.new),
+        ("updated", session.dirty),
+        ("deleted", session.deleted),
+    ):
+        for obj in objects:
+            table = getattr(obj, "__tablename__", None)
+            if table in TRACKED_TABLES and (action != "updated" or session.is_modified(obj)):
+                queue_change(session, action, table, [obj.id])
+
+
+def change_events(changes):
+    return [
+        {"action": action, "table": table, "ids": ids[start : start + MAX_IDS_PER_EVENT]}
+        for action, table, ids in changes
+        for start in range(0, len(ids), MAX_IDS_PER_EVENT)
+    ]
+
+
+def current_broker():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("change_feed")
+
+
+@event.listens_for(Session, "before_commit")
+def notify_in_transaction(session):
+    broker = current_broker()
+    if broker is None or not broker.notifies_in_transaction or session.in_nested_transaction():
+        return
+    # the commit flushes after this hook; flushing first collects the changes of that flush too
+    session.flush()
+    changes = session.info.get("pending_changes")
+    if changes:
+        connection = session.connection()
+        for change in change_events(changes):
+            broker.notify(connection, change)
+
+
+@event.listens_for(Session, "after_commit")
+def publish_changes(session):
+    changes = session.info.pop("pending_changes", None)
+    if not changes or not has_app_context():
+        return
+    changes = change_events(changes)
+    broker = current_broker()
+    if broker is not None and not broker.notifies_in_transaction:
+        for change in changes:
+            broker.publish(change)
+    # called once, in the worker that committed (e.g. CDN purges); broker listeners run in every worker
+    for hook in current_app.extensions.get("change_hooks", ()):
+        hook(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_changes(session):
+    session.info.pop("pending_changes", None)
+
+
+class Subscriber:
+    def __init__(self, buffer_size):
+        self.events = queue.Queue(maxsize=buffer_size)
+        # set when the client fell so far behind that its buffer filled up
+        self.overflowed = False
+
+    def deliver(self, change):
+        try:
+            self.events.put_nowait(change)
+        except queue.Full:
+            self.overflowed = True
+
+
+class LocalBroker:
+    notifies_in_transaction = False
+
+    def __init__(self, buffer_size=100):
+        self.buffer_size = buffer_size
+        self._subscribers = set()
+        # callbacks that see every change, e.g. the query cache's invalidation
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def start_listening(self):
+        pass
+
+    def subscribe(self):
+        subscriber = Subscriber(self.buffer_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def deliver(self, change):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.deliver(change)
+        for callback in self._listeners:
+            callback(change)
+
+    def publish(self, change):
+        self.deliver(change)
+
+
+class _ListeningBroker(LocalBroker):
+    """Starts a background listener in the worker the first time a client subscribes
+    (or the query cache is used)."""
+
+    def __init__(self, buffer_size=100):
+        super().__init__(buffer_size)
+        self._listener = None
+        self._listener_pid = None
+
+    def start_listening(self):
+        # a thread started in the gunicorn master doesn't survive the fork
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid != os.getpid():
+                self._listener = threading.Thread(target=self._listen_forever, daemon=True)
+                self._listener.start()
+                self._listener_pid = os.getpid()
+
+    def subscribe(self):
+        self.start_listening()
+        return super().subscribe()
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self.listen()
+            except Exception:
+                logger.exception("change feed listener failed, reconnecting")
+                time.sleep(1)
+
+
+class PostgresBroker(_ListeningBroker):
+    # changes are sent with notify() before the commit, and delivered by Postgres when it commits
+    notifies_in_transaction = True
+
+    def __init__(self, database_uri, buffer_size=100):
+        super().__init__(buffer_size)
+        # only the LISTEN threads connect through it
+        self.engine = create_engine(database_uri, poolclass=NullPool, isolation_level="AUTOCOMMIT")
+
+    def notify(self, connection, change):
+        connection.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": CHANNEL, "payload": json.dumps(change)},
+        )
+
+    def publish(self, change):
+        with self.engine.connect() as connection:
+            self.notify(connection, change)
+
+    def listen(self):
+        connection = self.engine.raw_connection()
+        try:
+            dbapi_connection = connection.driver_connection
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"LISTEN {CHANNEL}")
+            while True:
+                if select.select([dbapi_connection], [], [], 5) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    self.deliver(json.loads(notify.payload))
+        finally:
+            connection.close()
+
+
+class FileBroker(_ListeningBroker):
+    def __init__(self, path, buffer_size=100, max_size=1024 * 1024, poll_interval=0.2):
+        super().__init__(buffer_size)
+        self.path = path
+        self.max_size = max_size
+        self.poll_interval = poll_interval
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def publish(self, change):
+        line = (json.dumps(change) + "\n").encode("utf-8")
+        # a single O_APPEND write keeps lines from different workers whole
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size > self.max_size:
+                os.ftruncate(fd, 0)
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def listen(self):
+        offset = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        while True:
+            time.sleep(self.poll_interval)
+            if not os.path.exists(self.path):
+                continue
+            size = os.path.getsize(self.path)
+            if size < offset:
+                # the file was truncated by a writer
+                offset = 0
+            if size == offset:
+                continue
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+            complete, _, _ = data.rpartition(b"\n")
+            if not complete:
+                continue
+            offset += len(complete) + 1
+            for line in complete.split(b"\n"):
+                self.deliver(json.loads(line))
+
+
+def create_broker(app):
+    backend = app.config["CHANGE_FEED_BACKEND"]
+    buffer_size = app.config["CHANGE_FEED_CLIENT_BUFFER"]
+    if backend == "auto":
+        uri = app.config["SQLALCHEMY_DATABASE_URI"] or ""
+        backend = "postgres" if uri.startswith("postgres") else "file"
+    if backend == "postgres":
+        return PostgresBroker(app.config["SQLALCHEMY_DATABASE_URI"], buffer_size)
+    if backend == "file":
+        return FileBroker(
+            app.config.get("CHANGE_FEED_FILE")
+            or os.path.join(app.instance_path, "change_feed.log"),
+            buffer_size,
+        )
+    if backend == "local":
+        return LocalBroker(buffer_size)
+    raise ValueError(f"Unknown CHANGE_FEED_BACKEND: {backend}")
+
+
+def event_stream(broker, heartbeat=15):
+    """Yields Server-Sent Events for one client until it disconnects or falls behind."""
+    subscriber = broker.subscribe()
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                change = subscriber.events.get(timeout=heartbeat)
+            except queue.Empty:
+                # keeps proxies from closing an idle connection; lets us notice disconnects
+                yield ": keepalive\n\n"
+                continue
+            if subscriber.overflowed:
+                # the client missed events: tell it to resync (e.g. from /productions/changes)
+                yield "event: reset\ndata: {}\n\n"
+                return
+            yield f"event: change\ndata: {json.dumps(change)}\n\n"
+    finally:
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,78 @@
+# Streams the whole catalog (productions joined with their cast members) as NDJSON or CSV.
+# Rows come from a server-side cursor in batches of `batch_size` (yield_per), and output is
+# produced batch by batch, so memory use stays flat however large the catalog is.
+import csv
+import io
+import json
+from datetime import datetime
+
+from config import db
+from models import CastMember, Production
+
+PRODUCTION_COLUMNS = (
+    "id",
+    "title",
+    "genre",
+    "budget",
+    "image",
+    "director",
+    "description",
+    "ongoing",
+    "created_at",
+    "updated_at",
+)
+CAST_MEMBER_COLUMNS = ("id", "name", "role")
+CSV_HEADER = PRODUCTION_COLUMNS + tuple(f"cast_member_{c}" for c in CAST_MEMBER_COLUMNS)
+
+
+def catalog_rows(batch_size=1000):
+    stmt = (
+        db.select(
+            *[getattr(Production, c) for c in PRODUCTION_COLUMNS],
+            *[getattr(CastMember, c).label(f"cast_member_{c}") for c in CAST_MEMBER_COLUMNS],
+        )
+        .outerjoin(CastMember, CastMember.production_id == Production.id)
+        .order_by(Production.id, CastMember.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for partition in db.session.execute(stmt).partitions():
+        yield partition
+
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def ndjson_lines(batch_size=1000):
+    """One line per production, with its cast members nested."""
+    production = None
+    for partition in catalog_rows(batch_size):
+        lines = []
+        for row in partition:
+            if production is None or production["id"] != row.id:
+                if production is not None:
+                    lines.append(json.dumps(production))
+                production = {c: export_value(getattr(row, c)) for c in PRODUCTION_COLUMNS}
+                production["cast_members"] = []
+            if row.cast_member_id is not None:
+                production["cast_members"].append(
+                    {c: getattr(row, f"cast_member_{c}") for c in CAST_MEMBER_COLUMNS}
+                )
+        if lines:
+            yield "\n".join(lines) + "\n"
+    if production is not None:
+        yield json.dumps(production) + "\n"
+
+
+def csv_lines(batch_size=1000):
+    """One line per production and cast member; the cast member columns are empty for an empty cast."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for partition in catalog_rows(batch_size):
+        writer.writerows([export_value(value) for value in row] for row in partition)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,68 @@
+# Gunicorn settings for Render (and anywhere else we run gunicorn).
+# Start the server from the project root with:
+#   gunicorn -c server/gunicorn.conf.py
+# Every setting can be overridden with the environment variables read below.
+import gc
+import multiprocessing
+import os
+
+wsgi_app = "app:create_app()"
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = f"0.0.0.0:{os.environ.get('PORT', 5555)}"
+
+# sync: one request per process, gthread: a thread pool per process (the default, it suits
+# a database-bound app), gevent: green threads for long-lived connections such as streams
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class == "gevent":
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        worker_class = "gthread"
+
+cpu_count = multiprocessing.cpu_count()
+if worker_class == "sync":
+    default_workers = cpu_count * 2 + 1
+else:
+    default_workers = cpu_count + 1
+workers = int(os.environ.get("WEB_CONCURRENCY", default_workers))
+threads = int(os.environ.get("GUNICORN_THREADS", 4 if worker_class == "gthread" else 1))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+# import the app (models, bcrypt, flask-restful, sqlalchemy) once in the master;
+# the workers share those pages copy-on-write instead of importing everything again
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+# recycle workers now and then so slow leaks can't grow without bound; the jitter
+# keeps all the workers from restarting at the same moment
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+accesslog = "-"
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from sqlalchemy.orm import configure_mappers
+
+    # finish the lazy mapper setup before forking so every worker inherits it
+    configure_mappers()
+    # move everything imported so far out of the garbage collector's reach, so collections
+    # in the workers don't write to (and un-share) the pages inherited from the master
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    from config import db
+
+    app = server.app.wsgi()
+    # connections opened by the master must not be shared with the workers
+    with app.app_context():
+        db.engine.dispose(close=False)
+    if hasattr(app.session_interface, "reset"):
+        app.session_interface.reset()
@@ -0,0 +1,109 @@
+# Liveness and readiness probes for Render.
+# They are answered by WSGI middleware in front of Flask, so a probe never builds a request
+# context, opens the session or runs the before_request hooks.
+# /readyz connects through an engine of its own, without a pool, so it doesn't take one of the
+# app's connections or wait in line for one when the pool is exhausted under load.
+import json
+import math
+import os
+import threading
+import time
+
+from config import db
+from sqlalchemy import create_engine
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from sqlalchemy.pool import NullPool
+
+
+class HealthCheckMiddleware:
+    def __init__(self, app, wsgi_app, timeout_ms=1000, migration_check_ttl=5):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.timeout_ms = int(timeout_ms)
+        self.migration_check_ttl = migration_check_ttl
+        self._lock = threading.Lock()
+        self._engine = None
+        self._head = None
+        self._migrated = None
+        self._migration_checked_at = 0.0
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO")
+        if path == "/healthz":
+            return self.respond(start_response, 200, {"status": "ok"})
+        if path == "/readyz":
+            return self.readyz(start_response)
+        return self.wsgi_app(environ, start_response)
+
+    def respond(self, start_response, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        start_response(
+            "200 OK" if status == 200 else "503 Service Unavailable",
+            [
+                ("Content-Type", "application/json"),
+                ("Content-Length", str(len(payload))),
+                ("Cache-Control", "no-store"),
+            ],
+        )
+        return [payload]
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                url = db.engine.url
+            if url.get_backend_name() == "postgresql":
+                connect_args = {
+                    # whole seconds, for libpq
+                    "connect_timeout": max(1, math.ceil(self.timeout_ms / 1000)),
+                    "options": f"-c statement_timeout={self.timeout_ms}",
+                }
+            elif url.get_backend_name() == "sqlite":
+                # how long to wait for a locked database
+                connect_args = {"timeout": self.timeout_ms / 1000}
+            else:
+                connect_args = {}
+            self._engine = create_engine(url, poolclass=NullPool, connect_args=connect_args)
+        return self._engine
+
+    # the newest revision in migrations/versions; it can't change while the process runs
+    @property
+    def head(self):
+        if self._head is None:
+            from alembic.script import ScriptDirectory
+
+            script = ScriptDirectory(os.path.join(self.app.root_path, "migrations"))
+            self._head = script.get_current_head()
+        return self._head
+
+    def readyz(self, start_response):
+        try:
+            with self.engine.connect() as connection:
+                connection.exec_driver_sql("SELECT 1")
+                migrated = self.check_migrations(connection)
+        except SQLAlchemyError as e:
+            error = e.orig if isinstance(e, DBAPIError) else e
+            return self.respond(
+                start_response, 503, {"status": "database unavailable", "error": str(error)}
+            )
+
+        if not migrated:
+            return self.respond(start_response, 503, {"status": "migrations pending"})
+        return self.respond(start_response, 200, {"status": "ready"})
+
+    def check_migrations(self, connection):
+        with self._lock:
+            if time.monotonic() - self._migration_checked_at < self.migration_check_ttl:
+                return self._migrated
+        try:
+            current = connection.exec_driver_sql(
+                "SELECT version_num FROM alembic_version"
+            ).scalar()
+        except DBAPIError:
+            # no alembic_version table: the database has never been migrated
+            current = None
+        migrated = current == self.head
+        with self._lock:
+            self._migrated = migrated
+            self._migration_checked_at = time.monotonic()
+        return migrated
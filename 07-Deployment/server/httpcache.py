@@ -0,0 +1,269 @@
+# HTTP caching of public reads.
+#   - set_cache_headers (an after_request hook) marks GETs of PUBLIC routes as cacheable by
+#     browsers and proxies: public, max-age (browsers), s-maxage (proxies and CDNs, which get
+#     purged), stale-while-revalidate. Other routes are private. If the view read the session,
+#     the session interface makes the response private and adds Vary: Cookie (sessions.py).
+#   - Views tag responses with Surrogate-Key headers ("productions", "production-<id>", ...).
+#   - After a commit, the keys of the changed rows are purged: from a CDN through
+#     HTTP_CACHE_PURGE_URL, and from LocalCachingProxy, a stand-in for a caching proxy that can
+#     be put in front of the app for development and tests (HTTP_CACHE_LOCAL_PROXY).
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from io import BytesIO
+
+from auth import PUBLIC
+from flask import current_app, request
+from werkzeug.datastructures import ResponseCacheControl
+from werkzeug.http import parse_cache_control_header, parse_set_header
+
+logger = logging.getLogger(__name__)
+
+# the keys of a single row are "<singular>-<id>"; a whole table is its name
+ROW_KEY_PREFIXES = {"productions": "production", "cast_members": "cast-member"}
+# CDNs limit the number of keys purged per request
+MAX_KEYS_PER_PURGE = 256
+
+
+def row_key(table, id):
+    return f"{ROW_KEY_PREFIXES[table]}-{id}"
+
+
+def add_surrogate_keys(response, *keys):
+    existing = response.headers.get("Surrogate-Key", "").split()
+    response.headers["Surrogate-Key"] = " ".join(dict.fromkeys([*existing, *keys]))
+    return response
+
+
+def surrogate_keys_of(changes):
+    keys = []
+    for change in changes:
+        keys.append(change["table"])
+        keys.extend(row_key(change["table"], id) for id in change["ids"])
+    return list(dict.fromkeys(keys))
+
+
+def set_cache_headers(response):
+    if request.method not in ("GET", "HEAD") or response.status_code not in (200, 304):
+        return response
+    # views that set their own policy (streams, immutable images) keep it
+    if "Cache-Control" in response.headers:
+        return response
+
+    level = current_app.extensions["access_rules"].get((request.endpoint, request.method))
+    if level != PUBLIC:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config["HTTP_CACHE_MAX_AGE"]
+    response.cache_control.s_maxage = current_app.config["HTTP_CACHE_S_MAXAGE"]
+    stale = current_app.config["HTTP_CACHE_STALE_WHILE_REVALIDATE"]
+    if stale:
+        response.cache_control.stale_while_revalidate = stale
+    return response
+
+
+class SurrogateKeyPurger:
+    """POSTs purges to a CDN (a Surrogate-Key header per batch) from a background thread,
+    so a write never waits on the CDN."""
+
+    def __init__(self, url, token=None):
+        self.url = url
+        self.token = token
+        self._queue = queue.Queue()
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    def __call__(self, changes):
+        self._start()
+        self._queue.put(surrogate_keys_of(changes))
+
+    def _start(self):
+        # a thread started in the gunicorn master doesn't survive the fork
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid != os.getpid():
+                threading.Thread(target=self._run, daemon=True).start()
+                self._thread_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            keys = self._queue.get()
+            # everything queued meanwhile goes out together
+            while not self._queue.empty():
+                keys.extend(self._queue.get_nowait())
+            keys = list(dict.fromkeys(keys))
+            for start in range(0, len(keys), MAX_KEYS_PER_PURGE):
+                self.purge(keys[start : start + MAX_KEYS_PER_PURGE])
+
+    def purge(self, keys):
+        headers = {"Surrogate-Key": " ".join(keys)}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        try:
+            urllib.request.urlopen(
+                urllib.request.Request(self.url, method="POST", headers=headers), timeout=5
+            ).close()
+        except OSError:
+            logger.exception("purging %d surrogate keys failed", len(keys))
+
+
+class LocalCachingProxy:
+    """A small shared cache in front of the app, standing in for Varnish or a CDN.
+
+    It caches public GET responses for their max-age (s-maxage wins), serves them stale for
+    stale-while-revalidate seconds while one background request refreshes them, keys variants
+    by the request headers named in Vary, and drops responses by Surrogate-Key on purge.
+    Responses it serves carry X-Cache: HIT, STALE or MISS.
+    """
+
+    def __init__(self, wsgi_app, size=1000):
+        self.wsgi_app = wsgi_app
+        self.size = size
+        self.broker = None
+        self._entries = OrderedDict()
+        self._vary = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def listen_to(self, broker):
+        """Purges on the change feed: every worker has its own copy of the cache."""
+        self.broker = broker
+        broker.add_listener(lambda change: self.purge(surrogate_keys_of([change])))
+
+    def __call__(self, environ, start_response):
+        if self.broker is not None:
+            self.broker.start_listening()
+        if environ["REQUEST_METHOD"] != "GET":
+            return self.wsgi_app(environ, start_response)
+
+        key = self._key(environ)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry["stored_at"]
+            if age <= entry["max_age"]:
+                return self._serve(entry, "HIT", age, start_response)
+            if age <= entry["max_age"] + entry["stale"]:
+                self._refresh_in_background(key, environ)
+                return self._serve(entry, "STALE", age, start_response)
+
+        status, headers, app_iter, policy = self._run(environ)
+        if policy is None:
+            # not cacheable: streamed straight through
+            start_response(status, headers)
+            return app_iter
+        body = self._store(environ, status, headers, app_iter, policy)
+        start_response(status, headers + [("X-Cache", "MISS")])
+        return [body]
+
+    def purge(self, keys):
+        keys = set(keys)
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry["keys"] & keys]:
+                del self._entries[key]
+
+    def _base_key(self, environ):
+        return environ.get("PATH_INFO", ""), environ.get("QUERY_STRING", "")
+
+    def _key(self, environ):
+        base = self._base_key(environ)
+        names = self._vary.get(base, ())
+        return base + tuple(
+            environ.get("HTTP_" + name.upper().replace("-", "_"), "") for name in names
+        )
+
+    def _run(self, environ):
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured["status"], captured["headers"] = status, headers
+
+        app_iter = self.wsgi_app(environ, capture)
+        status, headers = captured["status"], captured["headers"]
+        return status, headers, app_iter, self._policy(status, headers)
+
+    def _store(self, environ, status, headers, app_iter, policy):
+        try:
+            body = b"".join(app_iter)
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+        with self._lock:
+            self._vary[self._base_key(environ)] = policy["vary"]
+            self._entries[self._key(environ)] = {
+                "status": status,
+                "headers": headers,
+                "body": body,
+                "stored_at": time.monotonic(),
+                **policy,
+            }
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return body
+
+    def _policy(self, status, headers):
+        if not status.startswith("200"):
+            return None
+        names = {name.lower(): value for name, value in headers}
+        cache_control = parse_cache_control_header(
+            names.get("cache-control"), cls=ResponseCacheControl
+        )
+        vary = tuple(parse_set_header(names.get("vary", "")))
+        if (
+            not cache_control.public
+            or cache_control.private
+            or cache_control.no_store
+            or cache_control.no_cache
+            or "set-cookie" in names
+            or "*" in vary
+        ):
+            return None
+        max_age = cache_control.s_maxage or cache_control.max_age or 0
+        return {
+            "max_age": max_age,
+            "stale": cache_control.stale_while_revalidate or 0,
+            "vary": vary,
+            "keys": set(names.get("surrogate-key", "").split()),
+        }
+
+    def _serve(self, entry, result, age, start_response):
+        start_response(
+            entry["status"], entry["headers"] + [("Age", str(int(age))), ("X-Cache", result)]
+        )
+        return [entry["body"]]
+
+    def _refresh_in_background(self, key, environ):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        fresh_environ = {
+            name: value
+            for name, value in environ.items()
+            if name not in ("HTTP_IF_NONE_MATCH", "HTTP_IF_MODIFIED_SINCE")
+        }
+        fresh_environ["wsgi.input"] = BytesIO()
+
+        def refresh():
+            try:
+                status, headers, app_iter, policy = self._run(fresh_environ)
+                if policy is None:
+                    if hasattr(app_iter, "close"):
+                        app_iter.close()
+                else:
+                    self._store(fresh_environ, status, headers, app_iter, policy)
+            except Exception:
+                logger.exception("refreshing %s failed", environ.get("PATH_INFO"))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
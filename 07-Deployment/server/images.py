@@ -0,0 +1,128 @@
+# Production posters are ingested once (uploaded, or read from a local directory with
+# `flask ingest-posters`) and cut into fixed-size JPEG thumbnails. Each thumbnail is stored under
+# the SHA-256 of its own bytes, so its URL (/images/<hash>) never changes meaning and can be cached
+# forever, and identical thumbnails are stored once.
+# Pillow does the resizing; it is imported on first use, so the app runs without it.
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+import click
+from config import db
+from events import queue_change
+from flask import current_app
+from flask.cli import with_appcontext
+
+# name -> (width, height); a poster is scaled and center-cropped to each size
+THUMBNAIL_SIZES = {
+    "small": (160, 240),
+    "large": (480, 720),
+}
+JPEG_QUALITY = 85
+IMAGE_HASH = re.compile(r"^[0-9a-f]{64}$")
+
+
+class PosterError(ValueError):
+    pass
+
+
+class ThumbnailsUnavailable(RuntimeError):
+    pass
+
+
+def make_thumbnails(data):
+    """Returns {size name: JPEG bytes} for the image in `data`."""
+    try:
+        from PIL import Image, ImageOps, UnidentifiedImageError
+    except ImportError:
+        raise ThumbnailsUnavailable("Poster thumbnails need Pillow (pip install pillow)") from None
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise PosterError("The poster is not a readable image") from None
+
+    thumbnails = {}
+    for name, size in THUMBNAIL_SIZES.items():
+        buffer = io.BytesIO()
+        ImageOps.fit(image, size, Image.Resampling.LANCZOS).save(
+            buffer, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True
+        )
+        thumbnails[name] = buffer.getvalue()
+    return thumbnails
+
+
+class ImageStore:
+    """Content-addressed files: <directory>/<first 2 hash characters>/<hash>.jpg"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, image_hash):
+        return os.path.join(self.directory, image_hash[:2], f"{image_hash}.jpg")
+
+    def save(self, data):
+        image_hash = hashlib.sha256(data).hexdigest()
+        path = self.path(image_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written under a temporary name and renamed, so a reader never sees half a file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return image_hash
+
+    def prepare(self, data):
+        """Makes the thumbnails of a poster without storing them; returns them with their URLs,
+        so they are only stored once the production they belong to has been updated."""
+        thumbnails = make_thumbnails(data)
+        urls = {
+            name: f"/images/{hashlib.sha256(thumbnail).hexdigest()}"
+            for name, thumbnail in thumbnails.items()
+        }
+        return thumbnails, urls
+
+    def store(self, thumbnails):
+        for thumbnail in thumbnails.values():
+            self.save(thumbnail)
+
+
+@click.command("ingest-posters")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@with_appcontext
+def ingest_posters(directory):
+    """Makes the thumbnails of every <production id>.<ext> poster in DIRECTORY."""
+    from models import Production
+
+    store = current_app.extensions["images"]
+    ingested = 0
+    for filename in sorted(os.listdir(directory)):
+        production_id, _ = os.path.splitext(filename)
+        if not production_id.isdigit():
+            continue
+        with open(os.path.join(directory, filename), "rb") as f:
+            try:
+                thumbnails, urls = store.prepare(f.read())
+            except ThumbnailsUnavailable as e:
+                raise click.ClickException(str(e))
+            except PosterError as e:
+                click.echo(f"{filename}: {e}")
+                continue
+        updated = db.session.execute(
+            db.update(Production)
+            .where(Production.id == int(production_id))
+            .values(thumbnails=urls, version=Production.version + 1)
+            .returning(Production.id)
+        ).scalars().all()
+        if not updated:
+            click.echo(f"{filename}: no production {production_id}")
+            continue
+        store.store(thumbnails)
+        queue_change(db.session, "updated", "productions", updated)
+        db.session.commit()
+        ingested += 1
+    click.echo(f"Ingested {ingested} posters")
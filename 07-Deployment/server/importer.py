@@ -0,0 +1,268 @@
+# `flask import-productions <file>` loads productions and cast members from the files written by
+# /exports/productions.csv and /exports/productions.ndjson. Rows are upserted by id, batch by batch:
+# on Postgres each batch is COPYed into temporary staging tables and merged with one
+# INSERT ... ON CONFLICT per table; elsewhere it is an executemany upsert.
+# Records are parsed and validated in worker processes, invalid ones are written to an error
+# report, and a checkpoint after every committed batch lets an interrupted import resume.
+import csv
+import io
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from time import perf_counter
+
+import click
+from config import db
+from events import queue_change
+from exports import CAST_MEMBER_COLUMNS
+from flask.cli import with_appcontext
+from schemas import CAST_MEMBER_SCHEMA, PRODUCTION_SCHEMA, Field, Schema, to_int
+from sqlalchemy.dialects import postgresql, sqlite
+from stats import refresh_production_stats
+
+IMPORTED_PRODUCTION_COLUMNS = ("id", "title", "genre", "budget", "image", "director", "description", "ongoing")
+IMPORTED_CAST_MEMBER_COLUMNS = ("id", "name", "role", "production_id")
+
+# the request schemas, plus the ids that imported rows are upserted by
+PRODUCTION_IMPORT_SCHEMA = Schema(
+    id=Field(to_int, required=True, nullable=False), **PRODUCTION_SCHEMA.fields
+)
+CAST_MEMBER_IMPORT_SCHEMA = Schema(
+    id=Field(to_int, required=True, nullable=False), **CAST_MEMBER_SCHEMA.fields
+)
+
+
+def read_records(path, file_format):
+    """Yields raw records: dicts for NDJSON lines, header-keyed dicts for CSV rows."""
+    with open(path, newline="") as f:
+        if file_format == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield line
+
+
+def import_values(record, columns):
+    """The record's values for `columns`; an empty CSV cell is a null."""
+    return {c: None if record.get(c) == "" else record.get(c) for c in columns if c in record}
+
+
+def parse_production(record):
+    production, errors = PRODUCTION_IMPORT_SCHEMA.validate(
+        import_values(record, PRODUCTION_IMPORT_SCHEMA.fields)
+    )
+    # the schema leaves out fields missing from the record; the upsert sets every column
+    return {c: production.get(c) for c in IMPORTED_PRODUCTION_COLUMNS}, errors
+
+
+def parse_cast_member(record, production_id):
+    cast_member, errors = CAST_MEMBER_IMPORT_SCHEMA.validate(
+        import_values(record, CAST_MEMBER_IMPORT_SCHEMA.fields)
+    )
+    cast_member = {c: cast_member.get(c) for c in IMPORTED_CAST_MEMBER_COLUMNS}
+    cast_member["production_id"] = production_id
+    return cast_member, {f"cast_member_{field}": error for field, error in errors.items()}
+
+
+def parse_chunk(args):
+    """Runs in a worker process: turns raw records into rows to load, plus the errors found and the
+    number of records read (CSV repeats a production on every cast member row)."""
+    file_format, first_record, records = args
+    productions, cast_members, errors = {}, [], []
+    for number, record in enumerate(records, start=first_record + 1):
+        try:
+            if file_format == "ndjson":
+                record = json.loads(record)
+                nested_cast = record.get("cast_members") or []
+            else:
+                nested_cast = []
+                if record.get("cast_member_id"):
+                    nested_cast = [
+                        {c: record.get(f"cast_member_{c}") for c in CAST_MEMBER_COLUMNS}
+                    ]
+        except ValueError as e:
+            errors.append({"record": number, "errors": {"record": str(e)}})
+            continue
+
+        production, record_errors = parse_production(record)
+        parsed_cast = []
+        for cast_record in nested_cast:
+            cast_member, cast_errors = parse_cast_member(cast_record, production.get("id"))
+            record_errors.update(cast_errors)
+            parsed_cast.append(cast_member)
+        if record_errors:
+            errors.append({"record": number, "errors": record_errors})
+            continue
+
+        # CSV repeats a production on every cast member row; the last copy wins
+        productions[production["id"]] = production
+        cast_members.extend(parsed_cast)
+    return list(productions.values()), cast_members, errors, len(records)
+
+
+def chunked_records(path, file_format, batch_size, skip):
+    records = read_records(path, file_format)
+    for _ in islice(records, skip):
+        pass
+    first = skip
+    while True:
+        chunk = list(islice(records, batch_size))
+        if not chunk:
+            return
+        yield file_format, first, chunk
+        first += len(chunk)
+
+
+def parse_chunks(chunks, executor, window):
+    """Parses the chunks in order. With an executor, at most `window` chunks are read ahead of the
+    one being loaded, so the file isn't read into memory faster than it is committed."""
+    if executor is None:
+        yield from map(parse_chunk, chunks)
+        return
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(executor.submit(parse_chunk, chunk))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # an aborted import doesn't wait for the chunks read ahead
+        for future in pending:
+            future.cancel()
+
+
+def upsert_sqlalchemy(connection, table, rows, columns):
+    if not rows:
+        return
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(table)
+    update_columns = {c: stmt.excluded[c] for c in columns if c != "id"}
+    update_columns["updated_at"] = db.func.now()
+    if "version" in table.c:
+        update_columns["version"] = table.c.version + 1
+    connection.execute(
+        stmt.on_conflict_do_update(index_elements=["id"], set_=update_columns),
+        [{c: row[c] for c in columns} for row in rows],
+    )
+
+
+def copy_upsert_postgres(connection, table, rows, columns):
+    if not rows:
+        return
+    staging = f"staging_{table.name}"
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["\\N" if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+
+    column_list = ", ".join(columns)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c != "id")
+    cursor = connection.connection.dbapi_connection.cursor()
+    cursor.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+        f"(LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    )
+    cursor.copy_expert(
+        f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer
+    )
+    version = f", version = {table.name}.version + 1" if "version" in table.c else ""
+    cursor.execute(
+        f"INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {staging} "
+        f"ON CONFLICT (id) DO UPDATE SET {updates}, updated_at = now(){version}"
+    )
+
+
+def read_checkpoint(path, source):
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    # a checkpoint only applies to the exact file it was written for
+    if checkpoint.get("size") != os.path.getsize(source):
+        return 0
+    return checkpoint["records"]
+
+
+def write_checkpoint(path, source, records):
+    with open(path, "w") as f:
+        json.dump({"records": records, "size": os.path.getsize(source)}, f)
+
+
+@click.command("import-productions")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["csv", "ndjson"]), help="Defaults to the file extension.")
+@click.option("--batch-size", default=5000, show_default=True, help="Records per transaction.")
+@click.option("--workers", default=os.cpu_count(), show_default=True, help="Parsing processes.")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint and start from the first record.")
+@with_appcontext
+def import_productions(path, file_format, batch_size, workers, restart):
+    """Upserts productions and cast members from a CSV or NDJSON export."""
+    from models import CastMember, Production
+
+    file_format = file_format or ("csv" if path.endswith(".csv") else "ndjson")
+    checkpoint_path = f"{path}.checkpoint"
+    errors_path = f"{path}.errors.ndjson"
+    skip = 0 if restart else read_checkpoint(checkpoint_path, path)
+    if skip:
+        click.echo(f"Resuming after record {skip}")
+
+    chunks = chunked_records(path, file_format, batch_size, skip)
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    parsed = parse_chunks(chunks, executor, window=2 * workers)
+
+    records, rows, error_count = skip, 0, 0
+    started = perf_counter()
+    try:
+        with open(errors_path, "a" if skip else "w") as errors_file:
+            for productions, cast_members, errors, chunk_records in parsed:
+                connection = db.session.connection()
+                if connection.dialect.name == "postgresql":
+                    copy_upsert_postgres(connection, Production.__table__, productions, IMPORTED_PRODUCTION_COLUMNS)
+                    copy_upsert_postgres(connection, CastMember.__table__, cast_members, IMPORTED_CAST_MEMBER_COLUMNS)
+                else:
+                    upsert_sqlalchemy(connection, Production.__table__, productions, IMPORTED_PRODUCTION_COLUMNS)
+                    upsert_sqlalchemy(connection, CastMember.__table__, cast_members, IMPORTED_CAST_MEMBER_COLUMNS)
+                queue_change(db.session, "updated", "productions", [p["id"] for p in productions])
+                queue_change(db.session, "updated", "cast_members", [c["id"] for c in cast_members])
+                db.session.commit()
+
+                for error in errors:
+                    errors_file.write(json.dumps(error) + "\n")
+                errors_file.flush()
+                records += chunk_records
+                rows += len(productions) + len(cast_members)
+                error_count += len(errors)
+                write_checkpoint(checkpoint_path, path, records)
+    finally:
+        parsed.close()
+        if executor:
+            executor.shutdown()
+
+    if db.session.connection().dialect.name == "postgresql":
+        # explicit ids don't advance the id sequences
+        for table in (Production.__table__, CastMember.__table__):
+            db.session.execute(
+                db.text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {table.name}), 1))"
+                )
+            )
+        db.session.commit()
+
+    # the command exits before a background refresh would run
+    refresh_production_stats(db.session.connection())
+    db.session.commit()
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    seconds = perf_counter() - started
+    click.echo(f"Imported {rows} rows in {seconds:.1f}s ({rows / max(seconds, 1e-6):,.0f} rows/s)")
+    if error_count:
+        click.echo(f"{error_count} invalid records written to {errors_path}")
@@ -1,4 +1,5 @@
 import logging
+import os
 from logging.config import fileConfig
 
 from flask import current_app
@@ -93,10 +94,31 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    # each migration commits on its own, so a migration can leave its transaction
+    # (e.g. for CREATE INDEX CONCURRENTLY, see online_migrations.py) without affecting the others
+    conf_args.setdefault("transaction_per_migration", True)
+
+    # production_stats (see stats.py) is created by its migration, not described by the models
+    def include_object(object, name, type_, reflected, compare_to):
+        return not (type_ == "table" and name == "production_stats")
+
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        # give up on a lock instead of queueing behind a long query, which would also
+        # block every query the app sends to that table after us
+        if connection.dialect.name == "postgresql":
+            connection.exec_driver_sql(
+                "SET lock_timeout = '%s'" % os.environ.get("MIGRATION_LOCK_TIMEOUT", "5s")
+            )
+            connection.exec_driver_sql(
+                "SET statement_timeout = '%s'"
+                % os.environ.get("MIGRATION_STATEMENT_TIMEOUT", "0")
+            )
+            connection.commit()
+
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
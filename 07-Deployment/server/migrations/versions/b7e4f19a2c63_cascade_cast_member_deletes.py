@@ -0,0 +1,40 @@
+"""cascade cast member deletes
+
+Revision ID: b7e4f19a2c63
+Revises: 9c1d2e7f3a40
+Create Date: 2026-10-19 10:03:51.114702
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4f19a2c63'
+down_revision = '9c1d2e7f3a40'
+branch_labels = None
+depends_on = None
+
+
+# the foreign key is unnamed on SQLite; batch mode reflects it under the name Postgres gave it.
+# Postgres alters the constraint in place, SQLite (no ALTER of constraints) copies the table
+NAMING_CONVENTION = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
+
+def replace_foreign_key(**kwargs):
+    with op.batch_alter_table('cast_members', naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('cast_members_production_id_fkey', type_='foreignkey')
+        batch_op.create_foreign_key(
+            'cast_members_production_id_fkey',
+            'productions',
+            ['production_id'],
+            ['id'],
+            **kwargs,
+        )
+
+
+def upgrade():
+    replace_foreign_key(ondelete='CASCADE')
+
+
+def downgrade():
+    replace_foreign_key()
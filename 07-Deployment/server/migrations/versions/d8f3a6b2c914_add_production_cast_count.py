@@ -0,0 +1,155 @@
+"""add production cast count
+
+Revision ID: d8f3a6b2c914
+Revises: c5d8e1f0a736
+Create Date: 2026-10-19 15:12:48.207351
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import backfill_in_batches, is_postgres
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8f3a6b2c914'
+down_revision = 'c5d8e1f0a736'
+branch_labels = None
+depends_on = None
+
+
+# the triggers that maintain cast_count (see cast_counts.py)
+POSTGRES_TRIGGERS = (
+    """
+    CREATE FUNCTION count_cast_members() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE productions SET cast_count = cast_count + added.n
+            FROM (SELECT production_id, COUNT(*) AS n FROM new_rows GROUP BY production_id) added
+            WHERE productions.id = added.production_id;
+        ELSIF TG_OP = 'DELETE' THEN
+            UPDATE productions SET cast_count = cast_count - removed.n
+            FROM (SELECT production_id, COUNT(*) AS n FROM old_rows GROUP BY production_id) removed
+            WHERE productions.id = removed.production_id;
+        ELSE
+            UPDATE productions SET cast_count = cast_count + moved.n
+            FROM (
+                SELECT production_id, SUM(delta) AS n FROM (
+                    SELECT o.production_id, -1 AS delta
+                    FROM old_rows o JOIN new_rows n ON n.id = o.id
+                    WHERE o.production_id IS DISTINCT FROM n.production_id
+                    UNION ALL
+                    SELECT n.production_id, 1
+                    FROM old_rows o JOIN new_rows n ON n.id = o.id
+                    WHERE o.production_id IS DISTINCT FROM n.production_id
+                ) deltas
+                GROUP BY production_id
+            ) moved
+            WHERE productions.id = moved.production_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER cast_members_count_insert AFTER INSERT ON cast_members
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_cast_members()
+    """,
+    """
+    CREATE TRIGGER cast_members_count_delete AFTER DELETE ON cast_members
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_cast_members()
+    """,
+    """
+    CREATE TRIGGER cast_members_count_update AFTER UPDATE ON cast_members
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_cast_members()
+    """,
+)
+
+SQLITE_TRIGGERS = (
+    """
+    CREATE TRIGGER cast_members_count_insert AFTER INSERT ON cast_members BEGIN
+        UPDATE productions SET cast_count = cast_count + 1 WHERE id = NEW.production_id;
+    END
+    """,
+    """
+    CREATE TRIGGER cast_members_count_delete AFTER DELETE ON cast_members BEGIN
+        UPDATE productions SET cast_count = cast_count - 1 WHERE id = OLD.production_id;
+    END
+    """,
+    """
+    CREATE TRIGGER cast_members_count_update AFTER UPDATE OF production_id ON cast_members
+    WHEN OLD.production_id IS NOT NEW.production_id BEGIN
+        UPDATE productions SET cast_count = cast_count - 1 WHERE id = OLD.production_id;
+        UPDATE productions SET cast_count = cast_count + 1 WHERE id = NEW.production_id;
+    END
+    """,
+)
+
+# production_stats (see c5d8e1f0a736) now groups by the column instead of counting the cast
+STATS_SELECT = """
+SELECT genre, ongoing, cast_count AS cast_size,
+       COUNT(*) AS productions, SUM(budget) AS budget_total, COUNT(budget) AS budgeted
+FROM productions
+GROUP BY genre, ongoing, cast_count
+"""
+
+OLD_STATS_SELECT = """
+SELECT p.genre, p.ongoing, COALESCE(c.cast_size, 0) AS cast_size,
+       COUNT(*) AS productions, SUM(p.budget) AS budget_total, COUNT(p.budget) AS budgeted
+FROM productions p
+LEFT JOIN (
+    SELECT production_id, COUNT(*) AS cast_size FROM cast_members GROUP BY production_id
+) c ON c.production_id = p.id
+GROUP BY p.genre, p.ongoing, COALESCE(c.cast_size, 0)
+"""
+
+
+def replace_stats_view(select):
+    if is_postgres():
+        op.execute('DROP MATERIALIZED VIEW production_stats')
+        op.execute(f'CREATE MATERIALIZED VIEW production_stats AS {select}')
+        op.execute(
+            'CREATE UNIQUE INDEX ix_production_stats_key '
+            'ON production_stats (genre, ongoing, cast_size)'
+        )
+    else:
+        op.drop_table('production_stats')
+        op.execute(f'CREATE TABLE production_stats AS {select}')
+
+
+def upgrade():
+    # a constant default: Postgres adds the column without rewriting the table
+    op.add_column(
+        'productions',
+        sa.Column('cast_count', sa.Integer(), server_default='0', nullable=False),
+    )
+    # the triggers count the cast written from now on, then the existing casts are counted
+    for statement in POSTGRES_TRIGGERS if is_postgres() else SQLITE_TRIGGERS:
+        op.execute(statement)
+    backfill_in_batches(
+        'productions',
+        {'cast_count': sa.text(
+            '(SELECT COUNT(*) FROM cast_members WHERE cast_members.production_id = productions.id)'
+        )},
+        where=sa.text(
+            'EXISTS (SELECT 1 FROM cast_members WHERE cast_members.production_id = productions.id)'
+        ),
+    )
+    replace_stats_view(STATS_SELECT)
+
+
+def downgrade():
+    replace_stats_view(OLD_STATS_SELECT)
+    on_table = ' ON cast_members' if is_postgres() else ''
+    for trigger in ('insert', 'delete', 'update'):
+        op.execute(f'DROP TRIGGER cast_members_count_{trigger}{on_table}')
+    if is_postgres():
+        op.execute('DROP FUNCTION count_cast_members()')
+    # SQLite copies the table to drop the column and can't reflect the unnamed budget check
+    with op.batch_alter_table(
+        'productions', table_args=(sa.CheckConstraint('budget > 100'),)
+    ) as batch_op:
+        batch_op.drop_column('cast_count')
@@ -0,0 +1,25 @@
+"""index cast members by production
+
+Revision ID: e6f0b2d94c17
+Revises: d3a85c0e6f12
+Create Date: 2026-10-19 12:41:09.226410
+
+"""
+from online_migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6f0b2d94c17'
+down_revision = 'd3a85c0e6f12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    create_index_concurrently(
+        'ix_cast_members_production_id_id', 'cast_members', ['production_id', 'id']
+    )
+
+
+def downgrade():
+    drop_index_concurrently('ix_cast_members_production_id_id', 'cast_members')
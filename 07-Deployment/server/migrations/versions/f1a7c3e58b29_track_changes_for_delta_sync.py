@@ -0,0 +1,65 @@
+"""track changes for delta sync
+
+Revision ID: f1a7c3e58b29
+Revises: e6f0b2d94c17
+Create Date: 2026-10-19 13:55:42.618095
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import (
+    backfill_in_batches,
+    create_index_concurrently,
+    drop_index_concurrently,
+)
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a7c3e58b29'
+down_revision = 'e6f0b2d94c17'
+branch_labels = None
+depends_on = None
+
+# SQLite can't reflect the unnamed check on productions, so a batch copy of the table has
+# to be given it again
+TABLE_ARGS = {
+    'productions': (sa.CheckConstraint('budget > 100'),),
+    'cast_members': (),
+}
+
+
+def upgrade():
+    op.create_table('tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(), nullable=False),
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_tombstones_deleted_at'), 'tombstones', ['deleted_at'], unique=False)
+
+    # rows written from now on get updated_at on insert; older rows are backfilled from created_at.
+    # func.now() is now() on Postgres and CURRENT_TIMESTAMP on SQLite, where batch mode copies
+    # the table to change the default
+    for table_name in ('productions', 'cast_members'):
+        with op.batch_alter_table(table_name, table_args=TABLE_ARGS[table_name]) as batch_op:
+            batch_op.alter_column('updated_at', server_default=sa.func.now())
+        backfill_in_batches(
+            table_name,
+            {'updated_at': sa.text('created_at')},
+            where=sa.text('updated_at IS NULL'),
+        )
+        create_index_concurrently(
+            op.f(f'ix_{table_name}_updated_at'), table_name, ['updated_at']
+        )
+
+
+def downgrade():
+    for table_name in ('cast_members', 'productions'):
+        drop_index_concurrently(op.f(f'ix_{table_name}_updated_at'), table_name)
+        with op.batch_alter_table(table_name, table_args=TABLE_ARGS[table_name]) as batch_op:
+            batch_op.alter_column('updated_at', server_default=None)
+
+    op.drop_index(op.f('ix_tombstones_deleted_at'), table_name='tombstones')
+    op.drop_table('tombstones')
@@ -1,4 +1,6 @@
 # 3.✅ Import bcyrpt from app (on config.py)
+from datetime import datetime
+
 from config import bcrypt, db
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import validates
@@ -19,15 +21,31 @@ class Production(db.Model, SerializerMixin):
     director = db.Column(db.String)
     description = db.Column(db.String)
     ongoing = db.Column(db.Boolean, default=True)
+    # {size name: "/images/<hash>"} once a poster has been ingested (see images.py)
+    thumbnails = db.Column(db.JSON)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
-    updated_at = db.Column(db.DateTime, onupdate=db.func.now())
-    cast_members = db.relationship("CastMember", backref="production", cascade="delete")
-
-    serialize_rules = ("-cast_members.production",)
-
+    updated_at = db.Column(
+        db.DateTime, server_default=db.func.now(), onupdate=db.func.now(), index=True
+    )
+    # bumped by every UPDATE so clients can send it back in If-Match
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # maintained by triggers on cast_members (see cast_counts.py). Cast changes don't bump the
+    # version, which single productions are cached and ETagged by, so only the list shows it
+    cast_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # the database deletes cast members through ON DELETE CASCADE, so the ORM doesn't load them first
+    cast_members = db.relationship(
+        "CastMember", backref="production", cascade="delete", passive_deletes=True
+    )
+
+    serialize_rules = ("-cast_members.production", "-cast_count")
+    # INSERTs and UPDATEs return the server-generated columns (RETURNING) instead of leaving them
+    # to be loaded by another SELECT
+    __mapper_args__ = {"eager_defaults": True}
+
+    # the column is nullable: a production may have no image
     @validates("image")
     def validate_image(self, key, image_path):
-        if ".jpg" not in image_path:
+        if image_path is not None and ".jpg" not in image_path:
             raise ValueError("Image file type must be a jpg")
         return image_path
 
@@ -38,19 +56,44 @@ class Production(db.Model, SerializerMixin):
 class CastMember(db.Model, SerializerMixin):
     __tablename__ = "cast_members"
 
+    # serves the keyset pagination of /productions/<id>/cast_members
+    __table_args__ = (db.Index("ix_cast_members_production_id_id", "production_id", "id"),)
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     role = db.Column(db.String)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
-    updated_at = db.Column(db.DateTime, onupdate=db.func.now())
-    production_id = db.Column(db.Integer, db.ForeignKey("productions.id"))
+    updated_at = db.Column(
+        db.DateTime, server_default=db.func.now(), onupdate=db.func.now(), index=True
+    )
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    production_id = db.Column(
+        db.Integer, db.ForeignKey("productions.id", ondelete="CASCADE")
+    )
 
     serialize_rules = ("-production.cast_members",)
+    __mapper_args__ = {"eager_defaults": True}
 
     def __repr__(self):
         return f"<Production Name:{self.name}, Role:{self.role}"
 
 
+# the columns to_dict() serializes: all of them but the ones serialize_rules leaves out
+def serialized_columns(model):
+    return [c for c in model.__table__.columns if f"-{c.key}" not in model.serialize_rules]
+
+
+def serialize_value(value):
+    if isinstance(value, datetime):
+        return value.strftime(SerializerMixin.datetime_format)
+    return value
+
+
+# serializes a row returned by a Core statement (e.g. UPDATE ... RETURNING) the same way to_dict() would
+def row_to_dict(row):
+    return {key: serialize_value(value) for key, value in row.items()}
+
+
 class User(db.Model, SerializerMixin):
     __tablename__ = "users"
 
@@ -62,6 +105,10 @@ class User(db.Model, SerializerMixin):
     # Note: When an underscore is used, it's a sign that the variable or method is for internal use.
     _password_hash = db.Column(db.String)
     admin = db.Column(db.Boolean, default=False)
+    # keys for service clients (see apikeys.py); deleting the user revokes them
+    api_keys = db.relationship("ApiKey", backref="user", cascade="delete", passive_deletes=True)
+
+    serialize_rules = ("-api_keys",)
 
     # 5.✅ Create a hybrid_property that will protect the hash from being viewed
     @hybrid_property
@@ -86,3 +133,51 @@ class User(db.Model, SerializerMixin):
 
     def __repr__(self):
         return f"USER: ID: {self.id}, Name {self.name}, Email: {self.email}, Admin: {self.admin}"
+
+
+# an API key is only shown once, when it is created; the database keeps its prefix, to find it by,
+# and an HMAC of the whole key, to check it with
+class ApiKey(db.Model, SerializerMixin):
+    __tablename__ = "api_keys"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    name = db.Column(db.String, nullable=False)
+    prefix = db.Column(db.String(16), nullable=False, unique=True)
+    digest = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    serialize_rules = ("-user", "-digest")
+    __mapper_args__ = {"eager_defaults": True}
+
+    def __repr__(self):
+        return f"<ApiKey Name:{self.name}, Prefix:{self.prefix}, User:{self.user_id}>"
+
+
+# remembers deleted rows so /productions/changes can tell clients what to drop
+class Tombstone(db.Model):
+    __tablename__ = "tombstones"
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String, nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, server_default=db.func.now(), index=True)
+
+    @classmethod
+    def record(cls, table_name, ids):
+        if ids:
+            db.session.execute(
+                db.insert(cls), [{"table_name": table_name, "row_id": id} for id in ids]
+            )
+
+
+# backs the server-side session store (see sessions.py); the session cookie only holds the id
+class ServerSession(db.Model):
+    __tablename__ = "sessions"
+
+    id = db.Column(db.String(32), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    last_seen = db.Column(db.DateTime)
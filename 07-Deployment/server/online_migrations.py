@@ -0,0 +1,82 @@
+# Helpers for migrations that have to run while the app keeps serving traffic.
+# On Postgres they avoid long write locks: indexes are built CONCURRENTLY outside a transaction,
+# and data backfills commit in small batches. On SQLite they fall back to the plain operations.
+import logging
+import time
+
+import sqlalchemy as sa
+from alembic import op
+
+logger = logging.getLogger("alembic.online_migrations")
+
+
+def is_postgres():
+    return op.get_bind().dialect.name == "postgresql"
+
+
+def create_index_concurrently(index_name, table_name, columns, **kw):
+    """Builds an index without blocking writes to the table.
+
+    If a concurrent build fails, Postgres leaves an INVALID index behind; drop it with
+    drop_index_concurrently before running the migration again.
+    """
+    if not is_postgres():
+        op.create_index(index_name, table_name, columns, **kw)
+        return
+    with op.get_context().autocommit_block():
+        op.create_index(
+            index_name,
+            table_name,
+            columns,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+            **kw,
+        )
+
+
+def drop_index_concurrently(index_name, table_name):
+    if not is_postgres():
+        op.drop_index(index_name, table_name=table_name)
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            index_name, table_name=table_name, postgresql_concurrently=True, if_exists=True
+        )
+
+
+def backfill_in_batches(table_name, values, where=None, batch_size=1000, pause=0.05, key="id"):
+    """Runs UPDATE <table> SET <values> over the rows matching `where`, `batch_size` rows at a time.
+
+    Each batch commits on its own so row locks are held briefly, and the pause between batches
+    leaves room for the app's queries. `values` and `where` may use sa.text() or column expressions.
+    """
+    table = sa.table(table_name, sa.column(key), *[sa.column(name) for name in values])
+    key_column = table.c[key]
+    last_key = None
+    updated = 0
+    started = time.monotonic()
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        while True:
+            batch = sa.select(key_column).order_by(key_column).limit(batch_size)
+            if where is not None:
+                batch = batch.where(where)
+            if last_key is not None:
+                batch = batch.where(key_column > last_key)
+            keys = connection.execute(batch).scalars().all()
+            if not keys:
+                break
+
+            connection.execute(sa.update(table).where(key_column.in_(keys)).values(values))
+            updated += len(keys)
+            last_key = keys[-1]
+            logger.info(
+                "backfill %s: %d rows updated (%.1f rows/s)",
+                table_name,
+                updated,
+                updated / max(time.monotonic() - started, 1e-6),
+            )
+            time.sleep(pause)
+
+    return updated
@@ -0,0 +1,201 @@
+# Caches the results of read-only ORM queries marked with the FromCache option:
+#     Production.query.options(FromCache("production")).filter_by(id=id).first()
+# Results are keyed by statement and parameters, kept frozen in a per-worker LRU, and merged
+# into the session on a hit without touching the database.
+# An entry is dropped when a table it read from is written: this worker's writes invalidate on
+# commit, and the other workers' writes arrive through the change feed. Tables the change feed
+# doesn't carry (users) are only refreshed by QUERY_CACHE_TTL in the other workers.
+# Invalidating a table also invalidates the tables the database deletes from along with it
+# (ON DELETE CASCADE), since those deletes are never written by the app.
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, loading
+from sqlalchemy.orm.interfaces import UserDefinedOption
+
+
+class FromCache(UserDefinedOption):
+    """Serves the query from the query cache; `name` groups its hit statistics."""
+
+    propagate_to_loaders = False
+
+    def __init__(self, name):
+        self.name = name
+
+
+def cascading_tables(metadata):
+    """{table name: names of the tables whose rows ON DELETE CASCADE deletes with its rows}"""
+    direct = defaultdict(set)
+    for table in metadata.tables.values():
+        for foreign_key in table.foreign_keys:
+            if (foreign_key.ondelete or "").upper() == "CASCADE":
+                direct[foreign_key.column.table.name].add(table.name)
+    cascades = {}
+    for name in direct:
+        reached, pending = set(), [name]
+        while pending:
+            for child in direct.get(pending.pop(), ()):
+                if child not in reached:
+                    reached.add(child)
+                    pending.append(child)
+        cascades[name] = frozenset(reached - {name})
+    return cascades
+
+
+class QueryCache:
+    def __init__(self, size=1000, ttl=60, max_rows=1000, cascades=None):
+        self.size = size
+        self.ttl = ttl
+        # results with more rows than this aren't worth the memory; they are never cached
+        self.max_rows = max_rows
+        self.broker = None
+        self.cascades = cascades or {}
+        self._entries = OrderedDict()  # key -> (frozen result, tables, expires at)
+        self._keys_by_table = defaultdict(set)
+        # bumped by every invalidation, so a result read before a write isn't cached after it
+        self._generations = defaultdict(int)
+        self._statement_cache = {}
+        self._lock = threading.Lock()
+        self.stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+
+    def listen_to(self, broker):
+        """Invalidates on the changes other workers publish to the change feed."""
+        self.broker = broker
+        broker.add_listener(lambda change: self.invalidate([change["table"]]))
+
+    def cache_key(self, statement, parameters):
+        return statement._generate_cache_key().to_offline_string(
+            self._statement_cache, statement, parameters or {}
+        )
+
+    def generations(self, tables):
+        return tuple(self._generations[table] for table in tables)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, frozen_result, tables, generations):
+        if len(frozen_result.data) > self.max_rows:
+            return
+        with self._lock:
+            if self.generations(tables) != generations:
+                return
+            self._remove(key)
+            self._entries[key] = (frozen_result, tables, time.monotonic() + self.ttl)
+            for table in tables:
+                self._keys_by_table[table].add(key)
+            while len(self._entries) > self.size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tables):
+        tables = set(tables)
+        for table in list(tables):
+            tables.update(self.cascades.get(table, ()))
+        with self._lock:
+            for table in tables:
+                self._generations[table] += 1
+                for key in list(self._keys_by_table.pop(table, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for table in list(self._keys_by_table):
+                self._generations[table] += 1
+            self._entries.clear()
+            self._keys_by_table.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            for table in entry[1]:
+                self._keys_by_table[table].discard(key)
+
+    def report(self):
+        return {
+            "entries": len(self._entries),
+            "queries": {
+                name: {**counts, "hit_rate": round(counts["hits"] / max(sum(counts.values()), 1), 3)}
+                for name, counts in sorted(self.stats.items())
+            },
+        }
+
+
+def current_cache():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("query_cache")
+
+
+def session_writes(session):
+    """Tables this session has written, or is about to write, in its current transaction."""
+    tables = set(session.info.get("written_tables", ()))
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        tables.add(obj.__table__.name)
+    return tables
+
+
+@event.listens_for(Session, "do_orm_execute")
+def cached_execute(orm_context):
+    if orm_context.is_insert or orm_context.is_update or orm_context.is_delete:
+        table = getattr(orm_context.statement.table, "name", None)
+        orm_context.session.info.setdefault("written_tables", set()).add(table)
+        return None
+
+    option = next(
+        (o for o in orm_context.user_defined_options if isinstance(o, FromCache)), None
+    )
+    cache = current_cache() if option else None
+    if cache is None or not cache.size:
+        return None
+    if cache.broker is not None:
+        cache.broker.start_listening()
+
+    tables = tuple(sorted({mapper.local_table.name for mapper in orm_context.all_mappers}))
+    if session_writes(orm_context.session) & set(tables):
+        # the database has uncommitted changes the cache doesn't know about
+        return None
+
+    key = cache.cache_key(orm_context.statement, orm_context.parameters)
+    frozen_result = cache.get(key)
+    if frozen_result is None:
+        cache.stats[option.name]["misses"] += 1
+        generations = cache.generations(tables)
+        frozen_result = orm_context.invoke_statement().freeze()
+        cache.set(key, frozen_result, tables, generations)
+    else:
+        cache.stats[option.name]["hits"] += 1
+
+    return loading.merge_frozen_result(
+        orm_context.session, orm_context.statement, frozen_result, load=False
+    )()
+
+
+@event.listens_for(Session, "after_flush")
+def collect_written_tables(session, flush_context):
+    written = session.info.setdefault("written_tables", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        written.add(obj.__table__.name)
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_written_tables(session):
+    tables = session.info.pop("written_tables", None)
+    cache = current_cache()
+    if tables and cache is not None:
+        cache.invalidate(tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_written_tables(session):
+    session.info.pop("written_tables", None)
@@ -0,0 +1,51 @@
+# Read-only views of the catalog for the list endpoints. They select the columns through Core and
+# keep each row as a plain named tuple: no instance state, identity map entry or lazy loaders,
+# just the values. They serialize to the same dicts as the models' to_dict().
+from collections import namedtuple
+
+from config import db
+from models import CastMember, Production, serialize_value, serialized_columns
+
+
+class ReadModel:
+    def __init__(self, model, extra_columns=()):
+        self.columns = (*serialized_columns(model), *extra_columns)
+        self.row = namedtuple(f"{model.__name__}Row", [column.key for column in self.columns])
+
+    def select(self):
+        return db.select(*self.columns)
+
+    def all(self, stmt):
+        make = self.row._make
+        return [make(row) for row in db.session.execute(stmt).tuples()]
+
+    def to_dict(self, row):
+        return {name: serialize_value(value) for name, value in zip(self.row._fields, row)}
+
+
+PRODUCTION_READ = ReadModel(Production)
+# what the /productions list shows of each production
+PRODUCTION_SUMMARY_READ = ReadModel(Production, [Production.cast_count])
+CAST_MEMBER_READ = ReadModel(CastMember)
+
+
+def production_summaries(with_cast=False):
+    productions = PRODUCTION_SUMMARY_READ.all(
+        PRODUCTION_SUMMARY_READ.select().order_by(Production.id)
+    )
+    summaries = [PRODUCTION_SUMMARY_READ.to_dict(p) for p in productions]
+    if with_cast:
+        # one query for every cast, instead of selectinload's one per 500 productions
+        cast_by_production = {summary["id"]: [] for summary in summaries}
+        cast_members = CAST_MEMBER_READ.all(
+            CAST_MEMBER_READ.select()
+            .where(CastMember.production_id.is_not(None))
+            .order_by(CastMember.production_id, CastMember.id)
+        )
+        for cast_member in cast_members:
+            cast = cast_by_production.get(cast_member.production_id)
+            if cast is not None:
+                cast.append(CAST_MEMBER_READ.to_dict(cast_member))
+        for summary in summaries:
+            summary["cast_members"] = cast_by_production[summary["id"]]
+    return summaries
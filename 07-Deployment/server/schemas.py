@@ -0,0 +1,147 @@
+# Request bodies are validated and coerced here, before any model is built. A Schema is compiled
+# once, at import, into a tuple of (field, coerce, required, nullable, checks); validating a body is a
+# single pass over it that collects every error instead of stopping at the first one.
+# Values arrive from JSON or from forms, so the coercions accept both 1.5 and "1.5".
+from flask import abort, make_response
+
+
+def to_string(value):
+    if not isinstance(value, str):
+        raise ValueError("must be a string")
+    return value
+
+
+def to_float(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("must be a number")
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError("must be a number") from None
+
+
+def to_int(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError("must be an integer")
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("must be an integer") from None
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ("true", "1", "t", "yes", "on"):
+        return True
+    if isinstance(value, str) and value.lower() in ("false", "0", "f", "no", "off", ""):
+        return False
+    raise ValueError("must be true or false")
+
+
+class Field:
+    def __init__(self, coerce, required=False, nullable=True, checks=()):
+        self.coerce = coerce
+        self.required = required
+        self.nullable = nullable
+        # (predicate, message) pairs run on the coerced value
+        self.checks = tuple(checks)
+
+
+def greater_than(bound):
+    return (lambda value: value > bound, f"must be greater than {bound}")
+
+
+def contains(text, message):
+    return (lambda value: text in value, message)
+
+
+class Schema:
+    def __init__(self, partial=False, **fields):
+        self.fields = fields
+        self.partial = partial
+        self._compiled = tuple(
+            (name, field.coerce, field.required and not partial, field.nullable, field.checks)
+            for name, field in fields.items()
+        )
+        self._names = frozenset(fields)
+
+    def only(self, names, partial=None):
+        """A schema for a subset of the fields, e.g. the fields a bulk update may change."""
+        return Schema(
+            partial=self.partial if partial is None else partial,
+            **{name: self.fields[name] for name in names},
+        )
+
+    def as_partial(self):
+        """The same fields with none of them required, for updates."""
+        return Schema(partial=True, **self.fields)
+
+    def validate(self, data, ignore=()):
+        """Returns (coerced values, errors); errors maps each bad field to a message.
+
+        `data` is a dict or a form; keys listed in `ignore` (e.g. "version") are skipped.
+        """
+        if not hasattr(data, "keys"):
+            return {}, {"_body": "must be an object"}
+
+        values, errors = {}, {}
+        for name in data.keys() - self._names - set(ignore):
+            errors[name] = "is not a known field"
+        for name, coerce, required, nullable, checks in self._compiled:
+            if name not in data:
+                if required:
+                    errors[name] = "is required"
+                continue
+            value = data[name]
+            if value is None:
+                if required or not nullable:
+                    errors[name] = "may not be null"
+                else:
+                    values[name] = None
+                continue
+            try:
+                value = coerce(value)
+            except ValueError as e:
+                errors[name] = e.args[0]
+                continue
+            for check, message in checks:
+                if not check(value):
+                    errors[name] = message
+                    break
+            else:
+                values[name] = value
+        return values, errors
+
+    def load(self, data, ignore=()):
+        """Returns the coerced values, or ends the request with a 422 listing every error."""
+        values, errors = self.validate(data, ignore)
+        if errors:
+            abort(make_response({"message": "Invalid data", "errors": errors}, 422))
+        return values
+
+
+PRODUCTION_SCHEMA = Schema(
+    title=Field(to_string, required=True, nullable=False),
+    genre=Field(to_string, required=True, nullable=False),
+    budget=Field(to_float, checks=[greater_than(100)]),
+    image=Field(to_string, checks=[contains(".jpg", "Image file type must be a jpg")]),
+    director=Field(to_string),
+    description=Field(to_string),
+    ongoing=Field(to_bool),
+)
+
+CAST_MEMBER_SCHEMA = Schema(
+    name=Field(to_string),
+    role=Field(to_string),
+)
+
+SIGNUP_SCHEMA = Schema(
+    name=Field(to_string, required=True, nullable=False),
+    email=Field(to_string, required=True, nullable=False),
+    password=Field(to_string, required=True, nullable=False),
+)
+
+API_KEY_SCHEMA = Schema(
+    name=Field(to_string, required=True, nullable=False),
+)
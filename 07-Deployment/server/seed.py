@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
-from app import app
+from app import create_app
 from faker import Faker
 from models import CastMember, Production, User, db
 
 fake = Faker()
+app = create_app()
 
 with app.app_context():
     CastMember.query.delete()
@@ -0,0 +1,407 @@
+# Server-side sessions: the cookie only carries a random session id and the session data lives in a store.
+# Every worker keeps a small LRU of recently used sessions in front of the store, and "last seen"
+# timestamps are written in batches, so a typical request reads from memory and writes nothing.
+# Expired sessions are deleted a batch at a time with each of those writes, and all at once by
+# `flask purge-sessions` (e.g. from a scheduled job); Redis expires them by itself.
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.datastructures import CallbackDict
+
+serializer = TaggedJSONSerializer()
+
+UPSERT_DIALECTS = {"postgresql": postgresql, "sqlite": sqlite}
+# expired sessions deleted per purge batch
+PURGE_BATCH_SIZE = 1000
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+def is_valid_session_id(sid):
+    return sid is not None and len(sid) == 22 and sid.replace("-", "").replace("_", "").isalnum()
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.initial_user_id = self.get("user_id")
+        self.modified = False
+        # set when a view reads the session: the response then depends on the cookie
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+# stores keep serialized session data keyed by session id, with an absolute expiry time (epoch seconds)
+class SQLAlchemySessionStore:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+
+    def load(self, sid):
+        with self.db.engine.connect() as connection:
+            row = connection.execute(
+                select(self.table.c.data, self.table.c.expires_at).where(
+                    self.table.c.id == sid
+                )
+            ).first()
+        if row is None or row.expires_at.replace(tzinfo=timezone.utc).timestamp() < time.time():
+            return None
+        return row.data
+
+    def save(self, sid, data, expires_at):
+        values = {
+            "data": data,
+            "expires_at": utc_datetime(expires_at),
+            "last_seen": utc_datetime(time.time()),
+        }
+        with self.db.engine.begin() as connection:
+            dialect = UPSERT_DIALECTS.get(connection.dialect.name)
+            if dialect is not None:
+                # a single INSERT ... ON CONFLICT, whether the session is new or not
+                stmt = dialect.insert(self.table).values(id=sid, **values)
+                connection.execute(
+                    stmt.on_conflict_do_update(index_elements=[self.table.c.id], set_=values)
+                )
+                return
+            updated = connection.execute(
+                update(self.table).where(self.table.c.id == sid).values(**values)
+            ).rowcount
+            if not updated:
+                connection.execute(insert(self.table).values(id=sid, **values))
+
+    def delete(self, sid):
+        with self.db.engine.begin() as connection:
+            connection.execute(delete(self.table).where(self.table.c.id == sid))
+
+    def touch_many(self, last_seen, lifetime):
+        stmt = (
+            update(self.table)
+            .where(self.table.c.id == bindparam("sid"))
+            .values(
+                last_seen=bindparam("seen"),
+                expires_at=bindparam("expires"),
+            )
+        )
+        with self.db.engine.begin() as connection:
+            connection.execute(
+                stmt,
+                [
+                    {"sid": sid, "seen": utc_datetime(seen), "expires": utc_datetime(seen + lifetime)}
+                    for sid, seen in last_seen.items()
+                ],
+            )
+
+    def purge_expired(self, batch_size=PURGE_BATCH_SIZE):
+        """Deletes up to batch_size expired sessions; returns how many it deleted."""
+        expired = (
+            select(self.table.c.id)
+            .where(self.table.c.expires_at < utc_datetime(time.time()))
+            .limit(batch_size)
+        )
+        with self.db.engine.begin() as connection:
+            return connection.execute(
+                delete(self.table).where(self.table.c.id.in_(expired.scalar_subquery()))
+            ).rowcount
+
+
+class FileSystemSessionStore:
+    def __init__(self, directory, lifetime):
+        self.directory = directory
+        # every write sets expires_at to at most its own time + lifetime, so a file written
+        # within the last lifetime seconds can't hold an expired session
+        self.lifetime = lifetime
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, sid)
+
+    def _read(self, sid):
+        try:
+            with open(self._path(sid)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, sid, record):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self._path(sid))
+
+    def load(self, sid):
+        record = self._read(sid)
+        if record is None or record["expires_at"] < time.time():
+            return None
+        return record["data"]
+
+    def save(self, sid, data, expires_at):
+        self._write(sid, {"data": data, "expires_at": expires_at, "last_seen": time.time()})
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except FileNotFoundError:
+            pass
+
+    def touch_many(self, last_seen, lifetime):
+        for sid, seen in last_seen.items():
+            record = self._read(sid)
+            if record is not None:
+                record.update(last_seen=seen, expires_at=seen + lifetime)
+                self._write(sid, record)
+
+    def purge_expired(self, batch_size=PURGE_BATCH_SIZE):
+        purged = 0
+        now = time.time()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if purged >= batch_size:
+                    break
+                try:
+                    if entry.stat().st_mtime > now - self.lifetime:
+                        continue
+                except FileNotFoundError:
+                    continue
+                record = self._read(entry.name)
+                if record is not None and record["expires_at"] < now:
+                    self.delete(entry.name)
+                    purged += 1
+        return purged
+
+
+# works with a redis-py client, or with LocalRedis for development and single-process setups
+class RedisSessionStore:
+    prefix = "session:"
+
+    def __init__(self, client):
+        self.client = client
+
+    def load(self, sid):
+        data = self.client.get(self.prefix + sid)
+        return data.decode("utf-8") if isinstance(data, bytes) else data
+
+    def save(self, sid, data, expires_at):
+        self.client.setex(self.prefix + sid, max(1, int(expires_at - time.time())), data)
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def touch_many(self, last_seen, lifetime):
+        for sid in last_seen:
+            self.client.expire(self.prefix + sid, int(lifetime))
+
+
+class LocalRedis:
+    """In-process stand-in for the subset of the Redis API used by RedisSessionStore."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._data.get(key, (None, 0))
+            if expires_at < time.time():
+                self._data.pop(key, None)
+                return None
+            return value
+
+    def setex(self, key, seconds, value):
+        with self._lock:
+            self._data[key] = (value, time.time() + seconds)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if key in self._data:
+                self._data[key] = (self._data[key][0], time.time() + seconds)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store, cache_size=1024, cache_ttl=5, touch_interval=60):
+        self.store = store
+        self.cache_size = cache_size
+        # how long another worker's logout can go unnoticed by this worker's cache
+        self.cache_ttl = cache_ttl
+        self.touch_interval = touch_interval
+        self.reset()
+
+    def reset(self):
+        """Drops the cache and pending writes, e.g. in a freshly forked worker."""
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._last_seen = {}
+        self._last_flush = time.monotonic()
+
+    def _cache_get(self, sid):
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is None:
+                return None
+            data, cached_at = entry
+            if time.monotonic() - cached_at > self.cache_ttl:
+                del self._cache[sid]
+                return None
+            self._cache.move_to_end(sid)
+            return data
+
+    def _cache_put(self, sid, data):
+        with self._lock:
+            self._cache[sid] = (data, time.monotonic())
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_discard(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+            self._last_seen.pop(sid, None)
+
+    def _touch(self, sid, app):
+        with self._lock:
+            self._last_seen[sid] = time.time()
+            if time.monotonic() - self._last_flush < self.touch_interval:
+                return
+            last_seen, self._last_seen = self._last_seen, {}
+            self._last_flush = time.monotonic()
+        self.store.touch_many(last_seen, app.permanent_session_lifetime.total_seconds())
+        if hasattr(self.store, "purge_expired"):
+            self.store.purge_expired()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not is_valid_session_id(sid):
+            return ServerSideSession()
+
+        data = self._cache_get(sid)
+        if data is None:
+            data = self.store.load(sid)
+            if data is None:
+                return ServerSideSession()
+            self._cache_put(sid, data)
+        return ServerSideSession(serializer.loads(data), sid=sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            # the response depends on the cookie, so shared caches must not store it
+            response.vary.add("Cookie")
+            if response.cache_control.public:
+                response.cache_control.public = False
+                response.cache_control.max_age = None
+                response.cache_control.s_maxage = None
+                response.cache_control.stale_while_revalidate = None
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+
+        if not session:
+            if session.sid and session.modified:
+                self.store.delete(session.sid)
+                self._cache_discard(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.modified:
+            if session.sid:
+                self._touch(session.sid, app)
+            return
+
+        # a new id whenever the logged in user changes guards against session fixation
+        if session.sid is None or session.get("user_id") != session.initial_user_id:
+            if session.sid:
+                self.store.delete(session.sid)
+                self._cache_discard(session.sid)
+            session.sid = new_session_id()
+
+        data = serializer.dumps(dict(session))
+        self.store.save(
+            session.sid, data, time.time() + app.permanent_session_lifetime.total_seconds()
+        )
+        self._cache_put(session.sid, data)
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def utc_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+
+def create_session_store(app, db, table):
+    backend = app.config["SESSION_BACKEND"]
+    if backend == "sqlalchemy":
+        return SQLAlchemySessionStore(db, table)
+    if backend == "filesystem":
+        return FileSystemSessionStore(
+            app.config.get("SESSION_FILE_DIR") or os.path.join(app.instance_path, "sessions"),
+            app.permanent_session_lifetime.total_seconds(),
+        )
+    if backend == "redis":
+        if not app.config.get("SESSION_REDIS_URL"):
+            return RedisSessionStore(LocalRedis())
+        import redis
+
+        return RedisSessionStore(redis.Redis.from_url(app.config["SESSION_REDIS_URL"]))
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+
+
+@click.command("purge-sessions")
+@with_appcontext
+def purge_sessions():
+    """Deletes every expired session from the session store."""
+    store = current_app.session_interface.store
+    if not hasattr(store, "purge_expired"):
+        click.echo("The session store expires sessions by itself")
+        return
+    purged = 0
+    while True:
+        deleted = store.purge_expired()
+        purged += deleted
+        if deleted < PURGE_BATCH_SIZE:
+            break
+    click.echo(f"Purged {purged} expired sessions")
@@ -0,0 +1,137 @@
+# Request coalescing for expensive reads. When a cached value is missing, the first request
+# computes it and concurrent requests for the same key wait for that result instead of running
+# the same queries themselves. When it has merely expired, the previous value is served for
+# `stale` more seconds while a single request refreshes it.
+# With a lock directory the coalescing extends across workers: the computation runs under an
+# flock on <lock_dir>/<key hash>.lock and its result is shared through a file next to the lock.
+# The lock is waited for no longer than wait_timeout: a hung computation in one worker doesn't
+# hold up the others, which serve the last shared result while it is within `stale`, or compute.
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+# how often a request waiting for another worker's computation retries the lock
+LOCK_POLL_INTERVAL = 0.05
+
+
+class SingleFlightCache:
+    def __init__(self, ttl=30, stale=30, wait_timeout=10, lock_dir=None):
+        self.ttl = ttl
+        self.stale = stale
+        # how long a request waits on another one's computation before doing it itself
+        self.wait_timeout = wait_timeout
+        self.lock_dir = lock_dir
+        self.broker = None
+        self._entries = {}  # key -> (value, computed from data as of this time.time())
+        self._flights = {}  # key -> threading.Event set when its computation ends
+        # a value computed from data older than the last write is never served
+        self._invalidated_at = 0.0
+        self._lock = threading.Lock()
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def listen_to(self, broker):
+        self.broker = broker
+        broker.add_listener(lambda change: self.invalidate())
+
+    def invalidate(self, changes=None):
+        with self._lock:
+            self._invalidated_at = time.time()
+            self._entries.clear()
+
+    def get(self, key, compute):
+        """Returns the value for `key`, calling compute() in at most one request at a time."""
+        if self.broker is not None:
+            self.broker.start_listening()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                return entry[0]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = threading.Event()
+
+        if not leader:
+            if entry is not None and now - entry[1] < self.ttl + self.stale:
+                return entry[0]
+            flight.wait(self.wait_timeout)
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+            # the computation failed, timed out or was invalidated: don't pile up behind it
+            return compute()
+
+        try:
+            value, as_of = self._compute(key, compute)
+            with self._lock:
+                if as_of > self._invalidated_at:
+                    self._entries[key] = (value, as_of)
+            return value
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.set()
+
+    def _compute(self, key, compute):
+        if not self.lock_dir:
+            as_of = time.time()
+            return compute(), as_of
+
+        import fcntl
+
+        path = os.path.join(self.lock_dir, hashlib.sha256(key.encode()).hexdigest())
+        with open(f"{path}.lock", "a") as lock:
+            # another worker computing the same key holds the lock until its result is written
+            if not self._acquire(lock):
+                shared = self._read_shared(path)
+                if shared is not None:
+                    value, as_of = shared
+                    if as_of > self._invalidated_at and time.time() - as_of < self.ttl + self.stale:
+                        return value, as_of
+                as_of = time.time()
+                return compute(), as_of
+            try:
+                shared = self._read_shared(path)
+                if shared is not None:
+                    value, as_of = shared
+                    if as_of > self._invalidated_at and time.time() - as_of < self.ttl:
+                        return value, as_of
+                as_of = time.time()
+                value = compute()
+                self._write_shared(path, value, as_of)
+                return value, as_of
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _acquire(self, lock):
+        import fcntl
+
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(LOCK_POLL_INTERVAL)
+
+    def _read_shared(self, path):
+        try:
+            with open(f"{path}.value", "rb") as f:
+                as_of = float(f.readline())
+                return f.read(), as_of
+        except (OSError, ValueError):
+            return None
+
+    def _write_shared(self, path, value, as_of):
+        fd, tmp_path = tempfile.mkstemp(dir=self.lock_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(f"{as_of}\n".encode())
+            f.write(value)
+        os.replace(tmp_path, f"{path}.value")
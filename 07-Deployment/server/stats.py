@@ -0,0 +1,168 @@
+# GET /productions/stats: counts and budget totals by genre, by ongoing/closed, and by cast size.
+# They are aggregated in SQL into production_stats, one row per (genre, ongoing, cast size), so the
+# endpoint reads a few dozen rows however large the catalog is:
+#   - Postgres: a materialized view, refreshed CONCURRENTLY so reads never wait on a refresh
+#   - elsewhere: a summary table, emptied and refilled in one transaction
+# StatsRefresher, a change hook, refreshes it in the background at most every
+# STATS_REFRESH_INTERVAL seconds after writes; `flask refresh-stats` refreshes it on demand.
+import logging
+import os
+import threading
+import time
+
+import click
+from config import db
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+STATS_VIEW = "production_stats"
+
+STATS_SELECT = """
+SELECT genre, ongoing, cast_count AS cast_size,
+       COUNT(*) AS productions, SUM(budget) AS budget_total, COUNT(budget) AS budgeted
+FROM productions
+GROUP BY genre, ongoing, cast_count
+"""
+
+production_stats = db.table(
+    STATS_VIEW,
+    db.column("genre", db.String),
+    db.column("ongoing", db.Boolean),
+    db.column("cast_size", db.Integer),
+    db.column("productions", db.Integer),
+    db.column("budget_total", db.Float),
+    db.column("budgeted", db.Integer),
+)
+
+
+def create_stats_view(connection):
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"CREATE MATERIALIZED VIEW {STATS_VIEW} AS {STATS_SELECT}")
+        # REFRESH ... CONCURRENTLY needs a unique index
+        connection.exec_driver_sql(
+            f"CREATE UNIQUE INDEX ix_{STATS_VIEW}_key ON {STATS_VIEW} (genre, ongoing, cast_size)"
+        )
+    else:
+        connection.exec_driver_sql(f"CREATE TABLE {STATS_VIEW} AS {STATS_SELECT}")
+
+
+def drop_stats_view(connection):
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"DROP MATERIALIZED VIEW IF EXISTS {STATS_VIEW}")
+    else:
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {STATS_VIEW}")
+
+
+# db.create_all() and db.drop_all() (tests, benchmarks) handle it along with the tables
+@event.listens_for(db.metadata, "after_create")
+def create_stats_view_after_tables(metadata, connection, **kw):
+    create_stats_view(connection)
+
+
+@event.listens_for(db.metadata, "before_drop")
+def drop_stats_view_before_tables(metadata, connection, **kw):
+    drop_stats_view(connection)
+
+
+def refresh_production_stats(connection):
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {STATS_VIEW}")
+    else:
+        connection.exec_driver_sql(f"DELETE FROM {STATS_VIEW}")
+        connection.exec_driver_sql(f"INSERT INTO {STATS_VIEW} {STATS_SELECT}")
+
+
+def summarize(rows, key):
+    groups = {}
+    for row in rows:
+        group = groups.setdefault(key(row), {"productions": 0, "budget_total": 0.0, "budgeted": 0})
+        group["productions"] += row.productions
+        group["budget_total"] += row.budget_total or 0.0
+        group["budgeted"] += row.budgeted
+    return {
+        name: {
+            "productions": group["productions"],
+            "budget_total": group["budget_total"],
+            "budget_average": (
+                group["budget_total"] / group["budgeted"] if group["budgeted"] else None
+            ),
+        }
+        for name, group in sorted(groups.items())
+    }
+
+
+def ongoing_status(row):
+    return {True: "ongoing", False: "closed"}.get(row.ongoing, "unknown")
+
+
+def production_stats_dict():
+    rows = db.session.execute(db.select(production_stats)).all()
+    totals = summarize(rows, lambda row: "all").get("all")
+    return {
+        **(totals or {"productions": 0, "budget_total": 0.0, "budget_average": None}),
+        "by_genre": summarize(rows, lambda row: row.genre),
+        "by_status": summarize(rows, ongoing_status),
+        "cast_sizes": [
+            {"cast_size": cast_size, "productions": group["productions"]}
+            for cast_size, group in summarize(rows, lambda row: row.cast_size).items()
+        ],
+    }
+
+
+class StatsRefresher:
+    """Refreshes production_stats from a background thread after writes.
+
+    The first write wakes the thread, which waits `interval` seconds so that a burst of writes
+    costs one refresh; the stats lag the writes by at most the interval plus the refresh.
+    """
+
+    def __init__(self, app, interval=5):
+        self.app = app
+        self.interval = interval
+        self._pending = threading.Event()
+        self._thread_pid = None
+        self._engine = None
+        self._lock = threading.Lock()
+
+    def __call__(self, changes):
+        self._start()
+        self._pending.set()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = db.engine
+        return self._engine
+
+    def _start(self):
+        # a thread started in the gunicorn master doesn't survive the fork
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid != os.getpid():
+                threading.Thread(target=self._run, daemon=True).start()
+                self._thread_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            time.sleep(self.interval)
+            # cleared before refreshing: a write committed during the refresh triggers another one
+            self._pending.clear()
+            try:
+                with self.engine.begin() as connection:
+                    refresh_production_stats(connection)
+            except Exception:
+                logger.exception("refreshing %s failed", STATS_VIEW)
+
+
+@click.command("refresh-stats")
+@with_appcontext
+def refresh_stats():
+    """Recomputes the /productions/stats aggregates, e.g. from a scheduled job."""
+    refresh_production_stats(db.session.connection())
+    db.session.commit()
+    click.echo(f"Refreshed {STATS_VIEW}")